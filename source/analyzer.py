@@ -0,0 +1,269 @@
+import json
+import heapq
+
+from planner import Planner
+from journal import Journal, get_percentile, format_seconds
+from util import print_help_line
+
+SIMULATED_JOBS = [1, 2, 4, 8, 16]
+SPEEDUP_CANDIDATES = 10
+
+
+class AnalyzedTask:
+    def __init__(self, name, module, namespace, command, index, dependencies, duration, estimated, group=None):
+        self.name = name
+        self.module = module
+        self.namespace = namespace
+        self.group = group
+        self.command = command
+        self.index = index
+        self.dependencies = dependencies
+        self.duration = duration
+        self.estimated = estimated
+
+
+# greedy list schedule of one barrier group on "jobs" workers, the ready task added first starts first and the
+# limited groups take at most their limit of workers like in the Scheduler. Durations can be overridden to see what
+# a faster task would change
+def simulate(tasks, jobs, durations=None, limits=None):
+    if durations is None:
+        durations = {task.name: task.duration for task in tasks}
+    limits = limits or {}
+    group_of = {task.name: task.group for task in tasks}
+    waiting_for = {task.name: set(task.dependencies) for task in tasks}
+    dependents = {}
+    for task in tasks:
+        for name in task.dependencies:
+            dependents.setdefault(name, []).append(task)
+    ready = [(task.index, task.name) for task in tasks if not waiting_for[task.name]]
+    heapq.heapify(ready)
+    running = []
+    group_running = {}
+    now = 0.0
+    while ready or running:
+        limited = []
+        while ready and len(running) < jobs:
+            index, name = heapq.heappop(ready)
+            group = group_of[name]
+            if group in limits and group_running.get(group, 0) >= limits[group]:
+                limited.append((index, name))
+                continue
+            group_running[group] = group_running.get(group, 0) + 1
+            heapq.heappush(running, (now + durations[name], name))
+        for item in limited:
+            heapq.heappush(ready, item)
+        now, name = heapq.heappop(running)
+        group_running[group_of[name]] -= 1
+        for dependent in dependents.get(name, []):
+            waiting_for[dependent.name].discard(name)
+            if not waiting_for[dependent.name]:
+                heapq.heappush(ready, (dependent.index, dependent.name))
+    return now
+
+
+# longest chain of a barrier group with unlimited workers, as (duration, [task names]). The tasks come in waves
+# order, so the dependencies of a task are always handled before it
+def get_critical_path(tasks, durations=None):
+    if durations is None:
+        durations = {task.name: task.duration for task in tasks}
+    finish = {}
+    previous = {}
+    for task in tasks:
+        start = 0.0
+        previous[task.name] = None
+        for name in task.dependencies:
+            if finish[name] > start:
+                start = finish[name]
+                previous[task.name] = name
+        finish[task.name] = start + durations[task.name]
+    if not finish:
+        return 0.0, []
+    name = max(finish, key=finish.get)
+    length = finish[name]
+    path = []
+    while name is not None:
+        path.append(name)
+        name = previous[name]
+    return length, list(reversed(path))
+
+
+# estimated critical path and wall time of a bulk or module command: the schedules are the ones the engine would
+# run, the scripts each task would spawn come from the planner and their durations from the run journal
+class Analyzer:
+    def __init__(self, engine, global_state_path, project=None, percentile=50):
+        self.engine = engine
+        self.planner = Planner(engine)
+        self.percentile = percentile
+        self.durations = {}
+        self.journaled_runs = 0
+        for entry in Journal.load(global_state_path):
+            if entry["kind"] != "script" or entry.get("project") not in [project, None]:
+                continue
+            duration = entry["end"] - entry["start"]
+            self.journaled_runs += 1
+            self.durations.setdefault((entry["module"], entry.get("namespace"), entry["command"]), []).append(duration)
+            self.durations.setdefault((entry["module"], entry["command"]), []).append(duration)
+        for durations in self.durations.values():
+            durations.sort()
+
+    # estimated duration of one script run, the runs of the same namespace first. None without journaled runs
+    def get_run_duration(self, run):
+        for key in [(run["module"], run["namespace"], run["script"]), (run["module"], run["script"])]:
+            if key in self.durations:
+                return get_percentile(self.durations[key], self.percentile)
+        return None
+
+    # a task runs the scripts of one namespace in order
+    def get_task_duration(self, task_plan):
+        total = 0.0
+        estimated = True
+        for run in task_plan["runs"]:
+            if run["action"] != "run":
+                continue
+            duration = self.get_run_duration(run)
+            if duration is None:
+                estimated = False
+                duration = 0.0
+            total += duration
+        return total, estimated
+
+    def get_groups(self, schedulers):
+        groups = []
+        for step, scheduler in schedulers:
+            for barrier, waves in scheduler.get_waves():
+                tasks = [task for wave in waves for task in wave]
+                analyzed_tasks = []
+                names = set(task.name for task in tasks)
+                for task in tasks:
+                    task_plan = self.planner.plan_task(task)
+                    duration, estimated = self.get_task_duration(task_plan)
+                    dependencies = [name for name in task.dependencies if name in names]
+                    analyzed_tasks.append(AnalyzedTask(task.name, task_plan["module"], task_plan["namespace"],
+                                                       task_plan["command"], task.index, dependencies, duration,
+                                                       estimated, group=task.group))
+                groups.append({"step": step, "priority": barrier, "tasks": analyzed_tasks,
+                               "limits": scheduler.limits})
+        return groups
+
+    @staticmethod
+    def get_wall_time(groups, jobs, durations=None):
+        return sum(simulate(group["tasks"], jobs, durations, group["limits"]) for group in groups)
+
+    def analyze(self, command, schedulers):
+        jobs = self.engine.get_jobs()
+        groups = self.get_groups(schedulers)
+        all_tasks = [task for group in groups for task in group["tasks"]]
+
+        critical_path = []
+        critical_length = 0.0
+        lower_bounds = {}
+        group_reports = []
+        for group in groups:
+            length, path = get_critical_path(group["tasks"])
+            work = sum(task.duration for task in group["tasks"])
+            critical_length += length
+            critical_path += [task for name in path for task in group["tasks"] if task.name == name]
+            for simulated_jobs in sorted(set(SIMULATED_JOBS + [jobs])):
+                lower_bounds[simulated_jobs] = lower_bounds.get(simulated_jobs, 0.0) + \
+                    max(length, work / simulated_jobs)
+            group_reports.append({
+                "step": group["step"],
+                "priority": group["priority"],
+                "tasks": len(group["tasks"]),
+                "work": work,
+                "criticalPath": length
+            })
+
+        wall_times = []
+        for simulated_jobs in sorted(lower_bounds):
+            wall_times.append({
+                "jobs": simulated_jobs,
+                "lowerBound": lower_bounds[simulated_jobs],
+                "simulated": self.get_wall_time(groups, simulated_jobs)
+            })
+
+        # what the run would save if a task took no time at all, with the current worker count and unlimited ones
+        wall_time = self.get_wall_time(groups, jobs)
+        candidates = []
+        for task in all_tasks:
+            if task.duration <= 0:
+                continue
+            durations = {other.name: other.duration for other in all_tasks}
+            durations[task.name] = 0.0
+            saved = wall_time - self.get_wall_time(groups, jobs, durations)
+            saved_unlimited = critical_length - sum(get_critical_path(group["tasks"], durations)[0]
+                                                    for group in groups)
+            if saved > 0 or saved_unlimited > 0:
+                candidates.append({"task": task.name, "module": task.module, "namespace": task.namespace,
+                                   "command": task.command,
+                                   "duration": task.duration, "saved": saved, "savedUnlimited": saved_unlimited})
+        candidates.sort(key=lambda candidate: (-candidate["saved"], -candidate["savedUnlimited"],
+                                               candidate["task"]))
+
+        return {
+            "command": command,
+            "jobs": jobs,
+            "percentile": self.percentile,
+            "journaledRuns": self.journaled_runs,
+            "groups": group_reports,
+            "criticalPath": [{"task": task.name, "module": task.module, "namespace": task.namespace,
+                              "command": task.command, "duration": task.duration} for task in critical_path],
+            "criticalPathDuration": critical_length,
+            "totalWork": sum(task.duration for task in all_tasks),
+            "wallTime": wall_time,
+            "wallTimes": wall_times,
+            "speedupCandidates": candidates[:SPEEDUP_CANDIDATES],
+            "withoutHistory": sorted(set(task.module for task in all_tasks if not task.estimated))
+        }
+
+    def analyze_bulk(self, command, selection=None):
+        return self.analyze(command, self.engine.get_bulk_schedulers(command, selection))
+
+    def analyze_module_exec(self, names, command):
+        scheduler = self.engine.get_module_exec_scheduler(names, command)
+        return self.analyze(command + " " + " ".join(names), [[command, scheduler]])
+
+    @staticmethod
+    def get_task_label(task):
+        return task["module"] + ("#" + task["namespace"] if task["namespace"] else "") + " " + task["command"]
+
+    @staticmethod
+    def print_analysis(analysis, output_format="text"):
+        if output_format == "json":
+            print(json.dumps(analysis, indent=4))
+            return
+        print("Analysis: " + analysis["command"] + " (jobs: " + str(analysis["jobs"]) + ", p" +
+              str(analysis["percentile"]) + " of " + str(analysis["journaledRuns"]) + " journaled script runs)")
+        for group in analysis["groups"]:
+            name = "Step " + group["step"]
+            if group["priority"] is not None:
+                name += ", priority " + str(group["priority"])
+            print_help_line(1, name, str(group["tasks"]) + " tasks, work " + format_seconds(group["work"]) +
+                            ", critical path " + format_seconds(group["criticalPath"]), col1_size=40)
+        print("")
+        print("Critical path (" + format_seconds(analysis["criticalPathDuration"]) + "):")
+        for task in analysis["criticalPath"]:
+            print_help_line(1, Analyzer.get_task_label(task), format_seconds(task["duration"]),
+                            col1_size=40)
+        print("")
+        print("Wall time (total work " + format_seconds(analysis["totalWork"]) + "):")
+        print_help_line(1, "jobs", "lower bound   simulated", col1_size=10, col_separator="   ")
+        for wall_time in analysis["wallTimes"]:
+            jobs = str(wall_time["jobs"]) + (" *" if wall_time["jobs"] == analysis["jobs"] else "")
+            print_help_line(1, jobs, "{:>11} {:>11}".format(format_seconds(wall_time["lowerBound"]),
+                                                           format_seconds(wall_time["simulated"])),
+                            col1_size=10, col_separator="   ")
+        print("")
+        if analysis["speedupCandidates"]:
+            print("Speedup candidates (wall time saved if the task took no time, at " + str(analysis["jobs"]) +
+                  " jobs / unlimited jobs):")
+            for candidate in analysis["speedupCandidates"]:
+                print_help_line(1, Analyzer.get_task_label(candidate),
+                                format_seconds(candidate["saved"]) + " / " +
+                                format_seconds(candidate["savedUnlimited"]) + " (takes " +
+                                format_seconds(candidate["duration"]) + ")", col1_size=40)
+        else:
+            print("Speedup candidates: none")
+        if analysis["withoutHistory"]:
+            print("")
+            print("No journaled runs (counted as 0s): " + ", ".join(analysis["withoutHistory"]))
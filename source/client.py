@@ -0,0 +1,19 @@
+import os
+import sys
+
+from daemon import DaemonClient, get_socket_path
+
+# thin launcher entry point: forwards the call to "daedalus serve" and falls back to a regular run
+
+
+def main(argv):
+    root_dir = os.environ.get("DAEDALUS_ROOT", os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    rc = DaemonClient(get_socket_path(root_dir)).run(argv[1:])
+    if rc is not None:
+        return rc
+    daedalus_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "daedalus.py")
+    os.execv(sys.executable, [sys.executable, daedalus_path] + argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
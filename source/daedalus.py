@@ -3,25 +3,18 @@ import sys
 import subprocess
 import json
 import atexit
+import shlex
+import time
+import traceback
 from time import gmtime, strftime
 
-import plugins.autossh
-import plugins.hosts
-import plugins.https
-import plugins.nginx
-import plugins.ssh
-import plugins.sshconfig
-import plugins.apply
-import plugins.template
-import plugins.apt
-import plugins.config_manager
-import plugins.deployer
-import plugins.shell
 import config
 import filelock
 from util import renew_env_var, apt_get, apt_update, id_generator, load_json
-from util import print_help_line
-from meta_engine import MetaEngine
+from util import DAEDALUS_ENV_FILE, load_env_file, save_env_file
+from util import print_help_line, get_real_path
+from plugin_registry import PluginRegistry
+from profiler import Profiler
 
 CURRENT_DAEDALUS_VERSION = "0.2.2"
 
@@ -32,15 +25,21 @@ KEY_DAEDALUS_FILE_LOCK_SESSION_UID = "DAEDALUS_FILE_LOCK_SESSION_UID"
 DAEDALUS_ROOT = None
 DAEDALUS_VERSION = None
 
-print("")
-command = ""
-for arg in sys.argv:
-    command += arg
-    command += " "
-print(strftime("[%Y-%m-%d %H:%M:%S]", gmtime()) + " executing command: " + command)
-
 flock = None
 session_uid = None
+engine = None
+engine_loaded = False
+plan_format = None
+
+
+def print_command_header(argv, output=None):
+    output = sys.stdout if output is None else output
+    print("", file=output)
+    command = ""
+    for arg in argv:
+        command += arg
+        command += " "
+    print(strftime("[%Y-%m-%d %H:%M:%S]", gmtime()) + " executing command: " + command, file=output)
 
 
 def exit_handler():
@@ -48,6 +47,13 @@ def exit_handler():
     flock.release()
 
 
+# what the atexit handlers do at the end of a regular run, a daemon request ends with os._exit() instead
+def end_request():
+    if flock is not None:
+        exit_handler()
+    Profiler.report()
+
+
 def start_session():
     global session_uid
     session_uid = os.environ.get(KEY_DAEDALUS_FILE_LOCK_SESSION_UID)
@@ -55,8 +61,10 @@ def start_session():
         session_uid = id_generator(32)
         os.environ[KEY_DAEDALUS_FILE_LOCK_SESSION_UID] = session_uid
 
-    filelock_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 
-                                "state/file-lock/")
+    root_dir = os.environ.get(KEY_DAEDALUS_ROOT)
+    if root_dir is None:
+        root_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    filelock_dir = os.path.join(root_dir, "state/file-lock/")
     filelock.FileLock.set_filelock_dir(filelock_dir)
     os.makedirs(filelock_dir, exist_ok=True)
 
@@ -83,15 +91,16 @@ def clean_running_session():
     flock = filelock.FileLock("daedalus", session_uid=session_uid, timeout=10)
     flock.release(force=True)
 
-start_session()
 
-if len(sys.argv) == 2:
-    if sys.argv[1] in ["clean-file-lock", "del-file-lock", "delete-file-lock", 
-                        "clean-flock", "del-flock", "delete-flock"]:
-        clean_running_session()
-        exit(0)
-
-single_session()
+def compile_daedalus(root_dir):
+    # precompiled bytecode spares every call from compiling the plugins, even when the invoking user can not
+    # write the source tree; the cache is still checked against the sources so a stale build is never used
+    import compileall
+    source_dir = os.path.join(root_dir, "source")
+    if not compileall.compile_dir(source_dir, quiet=1):
+        print("Warning: some Daedalus sources could not be compiled in " + source_dir)
+        return False
+    return True
 
 
 def install_daedalus():
@@ -127,14 +136,14 @@ def install_daedalus():
     subprocess.call("chmod ugo+x /etc/init.d/daedalus", shell=True)
     subprocess.call("update-rc.d daedalus defaults", shell=True)
 
-if len(sys.argv) == 2:
-    if sys.argv[1] == "install":
-        install_daedalus()
-        print("Daedalus install completed!")
-        exit(0)
+    compile_daedalus(DAEDALUS_ROOT)
 
 
 def load_env():
+    if os.environ.get(KEY_DAEDALUS_VERSION) is None or os.environ.get(KEY_DAEDALUS_ROOT) is None:
+        for key, value in load_env_file().items():
+            os.environ.setdefault(key, value)
+
     global DAEDALUS_VERSION
     DAEDALUS_VERSION = os.environ.get(KEY_DAEDALUS_VERSION)
     if os.environ.get("DAEDALUS_VERSION") is None:
@@ -154,33 +163,48 @@ def load_env():
               "installed correctly ...")
         exit(2)
 
+    if not os.path.isfile(DAEDALUS_ENV_FILE):
+        # installs that predate the env file get it on their first run
+        try:
+            save_env_file({KEY_DAEDALUS_ROOT: DAEDALUS_ROOT, KEY_DAEDALUS_VERSION: DAEDALUS_VERSION})
+        except OSError:
+            pass
+
+
+def load_engine():
+    global engine, engine_loaded
+    engine_loaded = True
+    if not config.Manager.is_in_project():
+        engine = None
+    elif engine is None or engine.project != config.Manager.get_project() or engine.is_stale():
+        with Profiler.phase("MetaEngine"):
+            from meta_engine import MetaEngine
+            engine = MetaEngine(DAEDALUS_ROOT, config.Manager.get_project())
+    else:
+        engine.refresh_installed_modules()
 
-load_env()
-
-config.Manager.set_root(DAEDALUS_ROOT)
-config.Manager.load()
 
-if config.Manager.is_in_project():
-    engine = MetaEngine(DAEDALUS_ROOT, config.Manager.get_project())
-else:
-    engine = None
+# the engine scans and validates every module of the project, so it is only built for commands that use it
+def get_engine():
+    if not engine_loaded:
+        load_engine()
+    return engine
 
 
 def get_metadata():
-    plugins.autossh.AutoSSHManager.load_current_context()
+    autossh = PluginRegistry.load_module("autossh")
+    autossh.AutoSSHManager.load_current_context()
     metadata = {
         "daedalus": None,
-        "autossh": plugins.autossh.AutoSSHManager.get_metadata(),
-        "hosts": plugins.hosts.HostsManager.get_metadata(),
-        "sshconfig": plugins.sshconfig.SSHConfigManager.get_metadata(),
-        "ssh": plugins.ssh.SSHManager.get_metadata()
+        "autossh": autossh.AutoSSHManager.get_metadata(),
+        "hosts": PluginRegistry.load_module("hosts").HostsManager.get_metadata(),
+        "sshconfig": PluginRegistry.load_module("sshconfig").SSHConfigManager.get_metadata(),
+        "ssh": PluginRegistry.load_module("ssh").SSHManager.get_metadata()
     }
-    if engine:
-        metadata["daedalus"] = engine.get_metadata()
+    if get_engine():
+        metadata["daedalus"] = get_engine().get_metadata()
     return metadata
 
-DAEDALUS_VERSION_META = load_json("version.json")
-
 
 def print_help():
     print_help_line(0, "Daedalus is a collection of tools and scripts with " + 
@@ -189,9 +213,36 @@ def print_help():
     print("")
     print_help_line(1, "Generic commands:")
     print_help_line(2, "help", "print this description")
+    print_help_line(2, "--env <key> <value>", "global option: set an " +
+                    "environment variable for the command")
+    print_help_line(2, "{--jobs, -j} <count>", "global option: number of " +
+                    "modules bulk commands run at the same time (default: " +
+                    "ConfigFS key option-bulk-jobs or 1)")
+    print_help_line(2, "--force", "global option: run fingerprinted " +
+                    "scripts even when their inputs did not change")
+    print_help_line(2, "--console={prefix, quiet, raw}", "global option: " +
+                    "show script output prefixed by its module (default), " +
+                    "only in the module logs under the project state dir, " +
+                    "or straight on the terminal without capturing it; captured scripts write to " +
+                    "a file rather than a terminal, so they may buffer their output and drop colors")
+    print_help_line(2, "--shell-exec", "global option: run scripts " +
+                    "through sudo and run_from_path.sh even when already " +
+                    "root (default: ConfigFS key option-exec-mode)")
+    print_help_line(2, "{--plan, --plan=json}", "global option: print " +
+                    "what a bulk, module or exec command would run (order, " +
+                    "parallel groups, scripts and ConfigFS params) without " +
+                    "running anything")
+    print_help_line(2, "--profile", "global option: print the time spent " +
+                    "in each startup phase and in child processes")
+    print_help_line(2, "--profile-json <path>", "global option: same as " +
+                    "--profile and also save the timings as JSON")
+    print_help_line(2, "--profile-cprofile <path>", "global option: save " +
+                    "cProfile stats for the whole run")
     print_help_line(2, "{clean-file-lock, del-file-lock, delete-file-lock, " + 
                     "clean-flock, del-flock, delete-flock}", "remove the " + 
                     "current file lock. Use only in case of emergency")
+    print_help_line(2, "compile", "rebuild the precompiled bytecode of " +
+                    "the Daedalus sources (done by install)")
     print_help_line(2, "upgrade", "update Daedalus to the latest version " + 
                     "(may broke backwards compatibility)")
     print_help_line(2, "{deploy, deploy-to, install-on, setup-machine} " + 
@@ -200,6 +251,23 @@ def print_help():
                     "various metadata from all plugins")
     print_help_line(2, "project", "submodule: add, remove and manage " + 
                     "Daedalus projects")
+    print_help_line(2, "serve", "run a long-lived Daedalus process that " +
+                    "answers calls made through the daedalus launcher")
+    print_help_line(2, "serve {stop, status}", "stop or check the running " +
+                    "Daedalus process")
+    print_help_line(2, "batch {<file>, -} [--keep-going]", "run one Daedalus " +
+                    "command per line (from file or stdin) in a single " +
+                    "process and session. With -, stdin holds the " +
+                    "lines, so the scripts they start get no input")
+    print_help_line(2, "history [--module <module>] [--command <command>] " +
+                    "[--top <count>] [--all-projects] [--json]", "print the " +
+                    "slowest script runs and the p50/p95 durations and " +
+                    "failure rates per module command from the run journal")
+    print_help_line(2, "analyze {<bulk command> [<bulk command options>], " +
+                    "<module command> <module> [<module> ...]} [--p95] " +
+                    "[--json]", "estimate the critical path, the wall time " +
+                    "per worker count and the modules worth speeding up " +
+                    "from the durations in the run journal")
     print_help_line(2, "startup", "trigger what happens at system booting")
     print_help_line(2, "shutdown", "trigger what happens att system shutdown")
     print("")
@@ -219,14 +287,21 @@ def print_help():
     print_help_line(2, "stop", "bulk stop installed modules")
     print_help_line(2, "sync-stop", "bulk sync-stop installed modules")
     print_help_line(2, "restart", "bulk restart installed modules")
+    print_help_line(2, "<bulk command> --affected-by <module>", "run a " +
+                    "bulk command only on the module and its dependents")
+    print_help_line(2, "<bulk command> --only <module> " +
+                    "[--with-dependents] [--with-dependencies]", "run a " +
+                    "bulk command only on the module (and its dependents " +
+                    "or dependencies)")
     print_help_line(2, "force-restart", "bulk force-restart installed modules")
     print_help_line(2, "info <module>", "prints information about module " + 
                     "(if it is defined)")
     print_help_line(2, "list-dependencies <module>", "prints a list " + 
                     "of dependencies for module")
     print_help_line(2, "{install, purge, reinstall, update, start, stop, " + 
-                    "restart, startup} <module>",
-                    "executes one of these commands on module")
+                    "restart, startup} <module> [<module> ...]",
+                    "executes one of these commands on modules. Recursive " +
+                    "commands run once on the union of their dependencies")
     print_help_line(2, "run <command> [arg1, arg2, ...]",
                     "runs a script/command in Daedalus environment " + 
                     "(passing arguments after the command)")
@@ -235,70 +310,88 @@ def print_help():
                     "after the command)")
     print("")
     print_help_line(1, "Plugins (run <plugin> help for details):")
-    print_help_line(2, "hosts", "easy way to edit and apply changes to " + 
-                    "/etc/hosts file")
-    print_help_line(2, "autossh", "manager for autossh connections")
-    print_help_line(2, "https", "wrapper over letsencrypt SSL " + 
-                    "certificate creation and renewal")
-    print_help_line(2, "ssh", "wrapper over ssh")
-    print_help_line(2, "nginx", "manager for nginx configuration. " + 
-                    "Implements nginx-modules")
-    print_help_line(2, "{sshconfig, sshconf}", "easy way to edit and apply " +
-                    "changes to ssh config files")
-    print_help_line(2, "apply", "collection for various system-wide " +
-                    "parameter tweaking setup")
-    print_help_line(2, "{template, jinja2}", "easy environment for jinja2 " +
-                    "template files rendering")
-    print_help_line(2, "apt", "wrapper over apt")
-    print_help_line(2, "{config-manager, conf-manager, conf-man, config-man}",
-                    "manager for configuration plugins")
-    print_help_line(2, "deployer", "deploy machines and clusters from JSON description files")
-    print_help_line(2, "shell", "wrapper for default shell")
-
-
-new_args = []
-state = 0
-payload_key = ""
-payload_val = ""
-for arg in sys.argv:
-    if arg == "--env" and state == 0:
-        state = 1
-    elif state == 1:
-        state = 2
-        payload_key = arg
-    elif state == 2:
-        state = 0
-        payload_val = arg
-        os.environ[payload_key] = payload_val
-    elif state == 0:
-        new_args.append(arg)
-sys.argv = new_args
-
-valid_command = False
-if len(sys.argv) == 1:
-    print("Daedalus is here! (" + str(DAEDALUS_VERSION) + ")")
-    valid_command = True
-elif len(sys.argv) == 2:
-    if sys.argv[1] == "help":
-        valid_command = True
-        print_help()
-    elif sys.argv[1] == "upgrade":
-        valid_command = True
-        subprocess.call("git pull", shell=True)
-        NEW_DAEDALUS_VERSION_META = load_json("version.json")
-        if NEW_DAEDALUS_VERSION_META["bump"] != DAEDALUS_VERSION_META["bump"]:
-            print("New version detected! Going to reinstall!")
-            subprocess.call(DAEDALUS_ROOT + "/install.sh", shell=True)
-elif len(sys.argv) == 3:
-    if sys.argv[1] in ["deploy", "deploy-to", "install-on", "setup-machine"]:
-        valid_command = True
-        host_address = sys.argv[2]
-        subprocess.call("daedalus ssh link root " + host_address, shell=True)
-        subprocess.call("daedalus ssh deploy-to " + host_address + " " + 
-                        DAEDALUS_ROOT + "/res/setup_new_machine.sh",
-                        shell=True)
+    for plugin in PluginRegistry.get_plugins():
+        if plugin.description is not None:
+            print_help_line(2, plugin.get_help_name(), plugin.description)
+
 
-if valid_command:
+def run_plugin(plugin, args):
+    from journal import Journal
+    start_time = time.time()
+    rc = 1
+    try:
+        return_code = plugin.parse_command(args)
+        rc = 0 if return_code else 2
+        return return_code
+    except SystemExit as e:
+        rc = e.code if isinstance(e.code, int) else int(e.code is not None)
+        raise
+    finally:
+        Journal.append(config.Manager.get_global_state_path(), "plugin", " ".join(args[:2]), start_time, rc,
+                       project=config.Manager.get_project())
+
+
+def history(args):
+    from journal import Journal
+    options = {"project": config.Manager.get_project(), "module": None, "command": None, "top": 10}
+    output_json = False
+    while args:
+        arg = args.pop(0)
+        if arg in ["--module", "--command", "--top"] and args:
+            options[arg[2:]] = args.pop(0)
+        elif arg == "--all-projects":
+            options["project"] = None
+        elif arg == "--json":
+            output_json = True
+        else:
+            print("Error: unknown history option \"" + arg + "\"! Run daedalus help for more info!")
+            exit(2)
+    if not str(options["top"]).isdigit():
+        print("Error: --top expects a number, got \"" + str(options["top"]) + "\"")
+        exit(2)
+    options["top"] = int(options["top"])
+    history_data = Journal.get_history(config.Manager.get_global_state_path(), **options)
+    if output_json:
+        print(json.dumps(history_data, indent=4))
+    else:
+        Journal.print_history(history_data)
+    exit(0)
+
+
+# analyze <bulk command> [bulk command options] or analyze <module command> <module> [<module> ...]
+def analyze(args):
+    from analyzer import Analyzer
+    percentile = 50
+    output_format = "text"
+    for option in ["--p95", "--json"]:
+        if option in args:
+            args.remove(option)
+            if option == "--p95":
+                percentile = 95
+            else:
+                output_format = "json"
+    if not args:
+        print("Error: analyze expects a bulk command or a module command followed by modules! " +
+              "Run daedalus help for more info!")
+        exit(2)
+    command = args.pop(0)
+    engine = ensure_engine()
+    analyzer = Analyzer(engine, config.Manager.get_global_state_path(), project=config.Manager.get_project(),
+                        percentile=percentile)
+    if command in BULK_COMMANDS and all(arg.startswith("--") for arg in args):
+        selection = None
+        if args:
+            selection = engine.filter_selection(parse_bulk_selection(args), engine.get_installed_modules())
+        analysis = analyzer.analyze_bulk(command, selection=selection)
+    elif command in MODULE_COMMANDS and args:
+        for name in args:
+            get_module_or_exit(name)
+        analysis = analyzer.analyze_module_exec(args, command)
+    else:
+        print("Error: analyze expects a bulk command or a module command followed by modules! " +
+              "Run daedalus help for more info!")
+        exit(2)
+    Analyzer.print_analysis(analysis, output_format=output_format)
     exit(0)
 
 
@@ -310,217 +403,493 @@ def check_plugin_return_code(return_code, plugin_name):
     else:
         exit(0)
 
-if len(sys.argv) >= 2 and sys.argv[1] in ["hosts"]:
-    args = sys.argv.copy()
-    args.pop(0)
-    check_plugin_return_code(plugins.hosts.parse_command(args), sys.argv[1])
-
-if len(sys.argv) >= 2 and sys.argv[1] in ["autossh"]:
-    args = sys.argv.copy()
-    args.pop(0)
-    check_plugin_return_code(plugins.autossh.parse_command(args), sys.argv[1])
-
-if len(sys.argv) >= 2 and sys.argv[1] in ["https"]:
-    args = sys.argv.copy()
-    args.pop(0)
-    check_plugin_return_code(plugins.https.parse_command(args), sys.argv[1])
-
-if len(sys.argv) >= 2 and sys.argv[1] in ["ssh"]:
-    args = sys.argv.copy()
-    args.pop(0)
-    check_plugin_return_code(plugins.ssh.parse_command(args), sys.argv[1])
-
-if len(sys.argv) >= 2 and sys.argv[1] in ["nginx"]:
-    args = sys.argv.copy()
-    args.pop(0)
-    check_plugin_return_code(plugins.nginx.parse_command(args), sys.argv[1])
-
-if len(sys.argv) >= 2 and sys.argv[1] in ["sshconfig", "sshconf"]:
-    args = sys.argv.copy()
-    args.pop(0)
-    check_plugin_return_code(plugins.sshconfig.parse_command(args), sys.argv[1])
-
-if len(sys.argv) >= 2 and sys.argv[1] in ["apply"]:
-    args = sys.argv.copy()
-    args.pop(0)
-    check_plugin_return_code(plugins.apply.parse_command(args), sys.argv[1])
-
-if len(sys.argv) >= 2 and sys.argv[1] in ["template", "jinja2"]:
-    args = sys.argv.copy()
-    args.pop(0)
-    check_plugin_return_code(plugins.template.parse_command(args), sys.argv[1])
-
-if len(sys.argv) >= 2 and sys.argv[1] in ["apt"]:
-    args = sys.argv.copy()
-    args.pop(0)
-    check_plugin_return_code(plugins.apt.parse_command(args), sys.argv[1])
-
-if len(sys.argv) >= 2 and sys.argv[1] in ["config-manager", "conf-manager", 
-                                          "conf-man", "config-man"]:
-    args = sys.argv.copy()
-    args.pop(0)
-    check_plugin_return_code(plugins.config_manager.parse_command(args), 
-                             sys.argv[1])
-
-if len(sys.argv) >= 2 and sys.argv[1] in ["deployer"]:
-    args = sys.argv.copy()
-    args.pop(0)
-    check_plugin_return_code(plugins.deployer.parse_command(args), sys.argv[1])
-
-if len(sys.argv) >= 2 and sys.argv[1] in ["shell"]:
-    args = sys.argv.copy()
-    args.pop(0)
-    check_plugin_return_code(plugins.shell.parse_command(args), sys.argv[1])
-
-if len(sys.argv) >= 2 and sys.argv[1] in ["project"]:
-    args = sys.argv.copy()
-    args.pop(0)
-    check_plugin_return_code(config.project_parse_command(args), sys.argv[1])
-
 
 def get_module_or_exit(name):
-    module_obj = engine.module(name)
+    module_obj = get_engine().module(name)
     if module_obj is None:
         print("could not find module <" + name + ">")
         exit(2)
     return module_obj
 
 
-def module_exec(name, command, params=None):
-    module = get_module_or_exit(name)
-    if module.is_recursive(command):
-        dependencies, namespace = engine.get_full_dependencies(name)
-        for dependence_name in dependencies:
-            module = get_module_or_exit(dependence_name)
-            if module.is_install_script(command) or namespace in \
-               module.available_namespaces:
-                module.set_namespace(namespace)
-            module.run(command, params=params)
-    else:
-        module.run(command, params=params)
+def print_plan(plan):
+    from planner import Planner
+    Planner.print_plan(plan, output_format=plan_format)
+    exit(1 if plan["errors"] else 0)
+
+
+def module_exec(names, command, params=None):
+    if not isinstance(names, list):
+        names = [names]
+    for name in names:
+        get_module_or_exit(name)
+    engine = get_engine()
+    if plan_format is not None:
+        from planner import Planner
+        print_plan(Planner(engine).plan_module_exec(names, command, params=params))
+    result = engine.get_module_exec_scheduler(names, command, params=params).run()
+    if result.get_rc() != 0:
+        print("Error: command \"" + command + "\" failed for " + str(result.get_failed()) +
+              (", skipped " + str(result.get_skipped()) if result.get_skipped() else ""))
+        exit(2)
+
+
+BULK_COMMANDS = ["update", "update-version", "start", "stop", "sync-stop", "restart", "force-restart"]
+MODULE_COMMANDS = ["install", "purge", "reinstall", "update", "start", "stop", "restart", "startup"]
+
+
+def bulk_exec(command, selection=None):
+    engine = ensure_engine()
+    if selection is not None:
+        selection = engine.filter_selection(selection, engine.get_installed_modules())
+        if plan_format is None:
+            print("Bulk " + command + " limited to: " + str(selection))
+    if plan_format is not None:
+        from planner import Planner
+        print_plan(Planner(engine).plan_bulk(command, selection=selection))
+    result = engine.exec_bulk(command, selection=selection)
+    if result is not None and result.get_rc() != 0:
+        exit(2)
+
+
+# bulk command options: --affected-by <module>, --only <module> [--with-dependents] [--with-dependencies]
+def parse_bulk_selection(args):
+    engine = ensure_engine()
+    affected_by = []
+    only = []
+    with_dependents = False
+    with_dependencies = False
+    index = 0
+    while index < len(args):
+        if args[index] in ["--affected-by", "--only"] and index + 1 < len(args):
+            get_module_or_exit(args[index + 1])
+            if args[index] == "--affected-by":
+                affected_by.append(args[index + 1])
+            else:
+                only.append(args[index + 1])
+            index += 2
+        elif args[index] == "--with-dependents":
+            with_dependents = True
+            index += 1
+        elif args[index] == "--with-dependencies":
+            with_dependencies = True
+            index += 1
+        else:
+            print("Invalid bulk command option \"" + args[index] + "\"! Run daedalus help for more info!")
+            exit(2)
+    if not affected_by and not only:
+        print("Bulk command options need at least one --affected-by or --only module!")
+        exit(2)
+    selection = engine.get_selection(affected_by, with_dependents=True) + \
+        engine.get_selection(only, with_dependents=with_dependents, with_dependencies=with_dependencies)
+    return list(dict.fromkeys(selection))
 
 
 def ensure_engine():
-    if not engine:
+    if not get_engine():
         print("MetaEngine: you are not currently in any project! Please " + 
               "switch to a project!")
         exit(2)
-
-if len(sys.argv) >= 2 and sys.argv[1] in ["cfs", "configfs"]:
-    ensure_engine()
-    args = sys.argv.copy()
-    args.pop(0)
-    if engine.parse_configfs_command(args):
-        exit(0)
-    else:
-        print("Invalid plugin (" + sys.argv[1] + ") command! Run \"daedalus " +
-              sys.argv[1] + " help\" for more info!")
+    return get_engine()
+
+
+# strips the global options from argv, --env assignments are returned so they can be applied when needed. The
+# "leading" ones are only taken before the command word, later ones belong to the command (exec mod backup --force)
+def parse_global_args(argv):
+    global plan_format
+    new_args = []
+    env = {}
+    state = 0
+    payload_key = ""
+    payload_val = ""
+    for arg in argv:
+        leading = state == 0 and len(new_args) <= 1
+        if arg == "--env" and state == 0:
+            state = 1
+        elif arg == "--profile" and leading:
+            Profiler.enable()
+        elif arg in ["--profile-json", "--profile-cprofile"] and leading:
+            state = 3
+            payload_key = arg
+        elif arg in ["--jobs", "-j"] and leading:
+            state = 4
+        elif arg == "--force" and leading:
+            env["DAEDALUS_FORCE_RUN"] = "1"
+        elif arg in ["--console=prefix", "--console=quiet", "--console=raw"] and leading:
+            env["DAEDALUS_CONSOLE"] = arg.split("=")[1]
+        elif arg == "--shell-exec" and leading:
+            env["DAEDALUS_EXEC_MODE"] = "shell"
+        elif arg in ["--plan", "--plan=text", "--plan=json"] and leading:
+            plan_format = "json" if arg == "--plan=json" else "text"
+        elif state == 1:
+            state = 2
+            payload_key = arg
+        elif state == 2:
+            state = 0
+            payload_val = arg
+            env[payload_key] = payload_val
+        elif state == 3:
+            state = 0
+            if payload_key == "--profile-json":
+                Profiler.enable(json_path=get_real_path(arg))
+            else:
+                Profiler.enable(cprofile_path=get_real_path(arg))
+        elif state == 4:
+            state = 0
+            if not arg.isdigit() or int(arg) < 1:
+                print("Error: --jobs expects a positive number, got \"" + arg + "\"")
+                exit(2)
+            env["DAEDALUS_JOBS"] = arg
+        elif state == 0:
+            new_args.append(arg)
+    return new_args, env
+
+
+def is_plannable(argv):
+    if len(argv) >= 2 and argv[1] in BULK_COMMANDS:
+        return True
+    if len(argv) >= 3 and argv[1] in MODULE_COMMANDS:
+        return True
+    return len(argv) >= 4 and argv[1] == "exec"
+
+
+# the header goes to stderr when stdout is JSON meant for another program
+def is_json_output(argv):
+    if plan_format == "json":
+        return True
+    return len(argv) >= 2 and argv[1] in ["history", "analyze"] and "--json" in argv[2:]
+
+
+def check_plan_format(argv):
+    if plan_format is not None and not is_plannable(argv):
+        print("Error: --plan is only available for bulk commands, module commands and exec")
         exit(2)
 
-if len(sys.argv) == 2:
-    if sys.argv[1] == "get-metadata":
-        valid_command = True
-        print(json.dumps(get_metadata()))
-    elif sys.argv[1] == "startup":
-        ensure_engine()
-        valid_command = True
-        plugins.autossh.AutoSSHManager.load_current_context()
-        engine.startup()
-    elif sys.argv[1] == "shutdown":
-        ensure_engine()
-        valid_command = True
-        engine.shutdown()
-    elif sys.argv[1] == "update":
-        ensure_engine()
-        valid_command = True
-        engine.update_all(soft=True)
-    elif sys.argv[1] == "update-version":
-        ensure_engine()
-        valid_command = True
-        engine.update_all(soft=False)
-    elif sys.argv[1] == "start":
-        ensure_engine()
-        valid_command = True
-        engine.exec_on_all("start")
-    elif sys.argv[1] in ["stop", "sync-stop"]:
-        ensure_engine()
-        valid_command = True
-        engine.exec_on_all(sys.argv[1])
-    elif sys.argv[1] == "restart":
-        ensure_engine()
-        valid_command = True
-        engine.exec_on_all("sync-stop", filter_as=["restart"])
-        engine.exec_on_all("start", filter_as=["restart"])
-    elif sys.argv[1] == "force-restart":
-        ensure_engine()
-        valid_command = True
-        engine.exec_reversed_on_all("force-stop")
-        engine.exec_on_all("start")
-    elif sys.argv[1] == "list-modules":
-        ensure_engine()
-        valid_command = True
-        print("Available modules: " + str(engine.get_modules()))
-    elif sys.argv[1] == "list-installed-modules":
-        ensure_engine()
-        valid_command = True
-        print("Installed modules: " + str(engine.get_installed_modules()))
-    elif sys.argv[1] == "info":
-        ensure_engine()
-        valid_command = True
-        print("Available modules: " + str(engine.get_modules()))
-        print("Installed modules: " + str(engine.get_installed_modules()))
-        for module_name in engine.get_modules():
-            print("-------------------------------")
-            get_module_or_exit(module_name).info()
-elif len(sys.argv) == 3:
-    if sys.argv[1] == "info":
-        ensure_engine()
-        valid_command = True
-        get_module_or_exit(sys.argv[2]).info()
-    elif sys.argv[1] == "list-dependencies":
-        ensure_engine()
-        valid_command = True
-        get_module_or_exit(sys.argv[2])
-        dependencies = engine.get_full_dependencies(sys.argv[2])
-        dependencies.reverse()
-        print("Dependencies for module <" + str(sys.argv[2]) + ">: " + 
-              str(dependencies))
-    elif sys.argv[1] in ["install", "purge", "reinstall", "update", "start", 
-                         "stop", "restart", "startup"]:
-        ensure_engine()
-        valid_command = True
-        module_exec(sys.argv[2], sys.argv[1])
-    elif sys.argv[1] == "run":
-        ensure_engine()
-        valid_command = True
-        engine.run_command(sys.argv[2])
-elif len(sys.argv) == 4:
-    if sys.argv[1] == "exec":
-        ensure_engine()
-        valid_command = True
-        module_exec(sys.argv[2], sys.argv[3])
-elif len(sys.argv) >= 5:
-    if sys.argv[1] == "exec":
-        ensure_engine()
+
+def run_command(argv):
+    valid_command = False
+    if len(argv) == 1:
+        print("Daedalus is here! (" + str(DAEDALUS_VERSION) + ")")
         valid_command = True
-        name = sys.argv[2]
-        script = sys.argv[3]
-        args = sys.argv.copy()
-        args.pop(0)
-        args.pop(0)
+    elif len(argv) == 2:
+        if argv[1] == "help":
+            valid_command = True
+            print_help()
+        elif argv[1] == "upgrade":
+            valid_command = True
+            DAEDALUS_VERSION_META = load_json("version.json")
+            subprocess.call("git pull", shell=True)
+            NEW_DAEDALUS_VERSION_META = load_json("version.json")
+            if NEW_DAEDALUS_VERSION_META["bump"] != DAEDALUS_VERSION_META["bump"]:
+                print("New version detected! Going to reinstall!")
+                subprocess.call(DAEDALUS_ROOT + "/install.sh", shell=True)
+    elif len(argv) == 3:
+        if argv[1] in ["deploy", "deploy-to", "install-on", "setup-machine"]:
+            valid_command = True
+            host_address = argv[2]
+            subprocess.call("daedalus ssh link root " + host_address, shell=True)
+            subprocess.call("daedalus ssh deploy-to " + host_address + " " + 
+                            DAEDALUS_ROOT + "/res/setup_new_machine.sh",
+                            shell=True)
+
+    if valid_command:
+        exit(0)
+
+    if len(argv) >= 2 and argv[1] == "history":
+        history(argv[2:])
+
+    if len(argv) >= 2 and argv[1] == "analyze":
+        analyze(argv[2:])
+
+    if len(argv) >= 2 and PluginRegistry.get(argv[1], external=False) is not None:
+        args = argv.copy()
         args.pop(0)
+        check_plugin_return_code(run_plugin(PluginRegistry.get(argv[1]), args), argv[1])
+
+    if len(argv) >= 3 and argv[1] in BULK_COMMANDS and argv[2].startswith("--"):
+        bulk_exec(argv[1], selection=parse_bulk_selection(argv[2:]))
+        exit(0)
+
+    if len(argv) >= 2 and argv[1] in ["cfs", "configfs"]:
+        engine = ensure_engine()
+        args = argv.copy()
         args.pop(0)
-        module_exec(name, script, params=args)
-    elif sys.argv[1] == "run":
-        ensure_engine()
+        if engine.parse_configfs_command(args):
+            exit(0)
+        else:
+            print("Invalid plugin (" + argv[1] + ") command! Run \"daedalus " +
+                  argv[1] + " help\" for more info!")
+            exit(2)
+
+    if len(argv) == 2:
+        if argv[1] == "get-metadata":
+            valid_command = True
+            print(json.dumps(get_metadata()))
+        elif argv[1] == "startup":
+            engine = ensure_engine()
+            valid_command = True
+            PluginRegistry.load_module("autossh").AutoSSHManager.load_current_context()
+            engine.startup()
+        elif argv[1] == "shutdown":
+            engine = ensure_engine()
+            valid_command = True
+            engine.shutdown()
+        elif argv[1] in BULK_COMMANDS:
+            valid_command = True
+            bulk_exec(argv[1])
+        elif argv[1] == "list-modules":
+            engine = ensure_engine()
+            valid_command = True
+            print("Available modules: " + str(engine.get_modules()))
+        elif argv[1] == "list-installed-modules":
+            engine = ensure_engine()
+            valid_command = True
+            print("Installed modules: " + str(engine.get_installed_modules()))
+        elif argv[1] == "info":
+            engine = ensure_engine()
+            valid_command = True
+            print("Available modules: " + str(engine.get_modules()))
+            print("Installed modules: " + str(engine.get_installed_modules()))
+            for module_name in engine.get_modules():
+                print("-------------------------------")
+                get_module_or_exit(module_name).info()
+    elif len(argv) == 3:
+        if argv[1] == "info":
+            engine = ensure_engine()
+            valid_command = True
+            get_module_or_exit(argv[2]).info()
+        elif argv[1] == "list-dependencies":
+            engine = ensure_engine()
+            valid_command = True
+            get_module_or_exit(argv[2])
+            dependencies, _ = engine.get_full_dependencies(argv[2])
+            dependencies.reverse()
+            print("Dependencies for module <" + str(argv[2]) + ">: " + 
+                  str(dependencies))
+        elif argv[1] in MODULE_COMMANDS:
+            engine = ensure_engine()
+            valid_command = True
+            module_exec(argv[2], argv[1])
+        elif argv[1] == "run":
+            engine = ensure_engine()
+            valid_command = True
+            engine.run_command(argv[2])
+    elif len(argv) >= 4 and argv[1] in MODULE_COMMANDS:
+        engine = ensure_engine()
         valid_command = True
-        script = sys.argv[2]
-        args = sys.argv.copy()
-        args.pop(0)
+        module_exec(argv[2:], argv[1])
+    elif len(argv) == 4:
+        if argv[1] == "exec":
+            engine = ensure_engine()
+            valid_command = True
+            module_exec(argv[2], argv[3])
+    elif len(argv) >= 5:
+        if argv[1] == "exec":
+            engine = ensure_engine()
+            valid_command = True
+            name = argv[2]
+            script = argv[3]
+            args = argv.copy()
+            args.pop(0)
+            args.pop(0)
+            args.pop(0)
+            args.pop(0)
+            module_exec(name, script, params=args)
+        elif argv[1] == "run":
+            engine = ensure_engine()
+            valid_command = True
+            script = argv[2]
+            args = argv.copy()
+            args.pop(0)
+            args.pop(0)
+            args.pop(0)
+            engine.run_command(script, params=args)
+
+    if not valid_command and len(argv) >= 2 and PluginRegistry.get(argv[1]) is not None:
+        args = argv.copy()
         args.pop(0)
-        args.pop(0)
-        engine.run_command(script, params=args)
+        check_plugin_return_code(run_plugin(PluginRegistry.get(argv[1]), args), argv[1])
+
+    if not valid_command:
+        print("Invalid command! Run daedalus help for more info!")
+
 
-if not valid_command:
-    print("Invalid command! Run daedalus help for more info!")
+# commands handled before the session is set up, they have no meaning inside a running batch
+BATCH_SESSION_COMMANDS = ["install", "compile", "clean-file-lock", "del-file-lock", "delete-file-lock", "clean-flock",
+                          "del-flock", "delete-flock"]
 
+
+def run_batch_line(argv):
+    global engine_loaded, plan_format
+    environ = os.environ.copy()
+    previous_plan_format = plan_format
+    try:
+        argv, env = parse_global_args(argv)
+        check_plan_format(argv)
+        os.environ.update(env)
+        run_command(argv)
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        plan_format = previous_plan_format
+        sys.stdout.flush()
+        # the line might have switched project or installed modules, re-check the engine before the next use
+        engine_loaded = False
+
+
+def run_batch(path, keep_going=False):
+    if path == "-":
+        lines = sys.stdin.readlines()
+    else:
+        try:
+            with open(get_real_path(path)) as batch_file:
+                lines = batch_file.readlines()
+        except OSError:
+            print("Batch: could not read file \"" + path + "\"")
+            exit(2)
+
+    failed = 0
+    executed = 0
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        try:
+            tokens = shlex.split(line)
+        except ValueError as e:
+            tokens = None
+            print("Batch: line " + str(line_number) + " could not be parsed (" + str(e) + ")")
+        if tokens and tokens[0] in ["daedalus", "dad"]:
+            tokens.pop(0)
+        executed += 1
+        start_time = time.time()
+        if tokens is None:
+            rc = 2
+        elif tokens and (tokens[0] in ["batch", "serve"] or (len(tokens) == 1 and tokens[0] in BATCH_SESSION_COMMANDS)):
+            print("Batch: line " + str(line_number) + " \"" + line + "\" can not run inside a batch")
+            rc = 2
+        else:
+            request_argv = [sys.argv[0]] + tokens
+            print_command_header(request_argv)
+            rc = run_batch_line(request_argv)
+        status = "ok" if rc == 0 else "failed (rc=" + str(rc) + ")"
+        print("Batch: line " + str(line_number) + " " + status + " in " +
+              "{0:.2f}".format(time.time() - start_time) + "s: " + line)
+        if rc != 0:
+            failed += 1
+            if not keep_going:
+                break
+
+    print("Batch: " + str(executed) + " command(s) executed, " + str(failed) + " failed")
+    exit(0 if failed == 0 else 2)
+
+
+def serve(argv):
+    from daemon import DaemonServer, DaemonClient, get_socket_path
+    load_env()
+    socket_path = get_socket_path(DAEDALUS_ROOT)
+    if len(argv) == 3:
+        if argv[2] == "stop":
+            exit(0 if DaemonClient(socket_path).stop() else 2)
+        elif argv[2] == "status":
+            exit(0 if DaemonClient(socket_path).status() else 2)
+        print("Invalid command! Run daedalus help for more info!")
+        exit(2)
+
+    config.Manager.set_root(DAEDALUS_ROOT)
+
+    def prepare():
+        global engine, engine_loaded
+        try:
+            config.Manager.load()
+            load_engine()
+        except SystemExit:
+            # invalid configuration, every request rebuilds the engine and reports the error itself
+            engine = None
+            engine_loaded = False
+
+    def handle_request(request_argv):
+        try:
+            main([argv[0]] + request_argv)
+        finally:
+            end_request()
+
+    prepare()
+    for plugin in PluginRegistry.get_plugins():
+        try:
+            plugin.load_module()
+        except ImportError:
+            pass
+
+    DaemonServer(socket_path, handle_request, prepare=prepare).serve_forever()
+
+
+def main(argv):
+    sys.argv = argv
+    command_argv = argv
+    argv, env = parse_global_args(argv)
+    print_command_header(command_argv, output=sys.stderr if is_json_output(argv) else None)
+    # before anything runs: install, compile and the session handling below are not plannable either
+    check_plan_format(argv)
+    if Profiler.enabled:
+        atexit.register(Profiler.report)
+
+    if len(argv) >= 2 and argv[1] == "serve":
+        serve(argv)
+        exit(0)
+    from process_manager import ProcessManager
+    ProcessManager.install_signal_handlers()
+
+    with Profiler.phase("session"):
+        start_session()
+
+        if len(argv) == 2:
+            if argv[1] in ["clean-file-lock", "del-file-lock", "delete-file-lock", 
+                           "clean-flock", "del-flock", "delete-flock"]:
+                clean_running_session()
+                exit(0)
+
+        single_session()
+
+    if len(argv) == 2:
+        if argv[1] == "install":
+            install_daedalus()
+            print("Daedalus install completed!")
+            exit(0)
+        if argv[1] == "compile":
+            compile_daedalus(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+            exit(0)
+
+    with Profiler.phase("load_env"):
+        load_env()
+
+    with Profiler.phase("config.Manager.load"):
+        config.Manager.set_root(DAEDALUS_ROOT)
+        config.Manager.load()
+
+    # every line of a batch starts from the environment set by the global options
+    os.environ.update(env)
+    if len(argv) >= 3 and argv[1] == "batch":
+        with Profiler.phase("batch"):
+            if len(argv) == 3:
+                run_batch(argv[2])
+            elif len(argv) == 4 and argv[3] == "--keep-going":
+                run_batch(argv[2], keep_going=True)
+
+    with Profiler.phase("command"):
+        run_command(argv)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import socket
+import signal
+import array
+import traceback
+
+# keep this module free of Daedalus imports, the thin client loads it on every call
+
+
+def get_socket_path(root_dir):
+    return os.path.join(root_dir, "state/daemon.sock")
+
+
+def exit_code(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+class DaemonServer:
+    def __init__(self, socket_path, handler, prepare=None):
+        self.socket_path = socket_path
+        self.handler = handler
+        self.prepare = prepare
+        self.listener = None
+        self.running = False
+        self.children = set()
+
+    def bind(self):
+        if DaemonClient(self.socket_path).status(quiet=True):
+            print("Daemon: there is already a Daedalus process listening on " + self.socket_path)
+            exit(2)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            self.listener.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        self.listener.listen(64)
+        self.listener.settimeout(1.0)
+
+    def stop(self, signum=None, frame=None):
+        self.running = False
+
+    def serve_forever(self):
+        self.bind()
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        print("Daemon: listening on " + self.socket_path)
+        sys.stdout.flush()
+        try:
+            while self.running:
+                self.reap_children()
+                try:
+                    conn, _ = self.listener.accept()
+                except socket.timeout:
+                    continue
+                except InterruptedError:
+                    continue
+                try:
+                    self.handle_connection(conn)
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    conn.close()
+        finally:
+            self.listener.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        print("Daemon: stopped")
+
+    def reap_children(self):
+        for pid in list(self.children):
+            try:
+                finished_pid, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                finished_pid = pid
+            if finished_pid != 0:
+                self.children.discard(pid)
+
+    @staticmethod
+    def receive_request(conn):
+        conn.settimeout(10.0)
+        fds = array.array("i")
+        data, ancdata, _, _ = conn.recvmsg(65536, socket.CMSG_SPACE(3 * fds.itemsize))
+        for level, kind, payload in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(payload[:len(payload) - (len(payload) % fds.itemsize)])
+        while not data.endswith(b"\n"):
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        conn.settimeout(None)
+        return json.loads(data.decode()), list(fds)
+
+    def handle_connection(self, conn):
+        request, fds = self.receive_request(conn)
+        command = request.get("command", "run")
+        if command == "status":
+            conn.sendall(("status " + str(os.getpid()) + "\n").encode())
+            return
+        if command == "stop":
+            conn.sendall(b"exit 0\n")
+            self.running = False
+            return
+        if len(fds) != 3:
+            for fd in fds:
+                os.close(fd)
+            conn.sendall(b"exit 2\n")
+            return
+
+        if self.prepare is not None:
+            self.prepare()
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        pid = os.fork()
+        if pid == 0:
+            self.run_child(conn, request, fds)
+        self.children.add(pid)
+        for fd in fds:
+            os.close(fd)
+
+    def run_child(self, conn, request, fds):
+        rc = 1
+        try:
+            self.listener.close()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            os.setsid()
+            for target_fd, fd in enumerate(fds):
+                os.dup2(fd, target_fd)
+                os.close(fd)
+            sys.stdin = os.fdopen(0, "r", closefd=False)
+            sys.stdout = os.fdopen(1, "w", buffering=1, closefd=False)
+            sys.stderr = os.fdopen(2, "w", buffering=1, closefd=False)
+            os.environ.clear()
+            os.environ.update(request["env"])
+            os.chdir(request["cwd"])
+            conn.sendall(("pid " + str(os.getpid()) + "\n").encode())
+            try:
+                self.handler(request["argv"])
+                rc = 0
+            except SystemExit as e:
+                rc = exit_code(e.code)
+            except KeyboardInterrupt:
+                rc = 130
+            except BaseException:
+                traceback.print_exc()
+                rc = 1
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                conn.sendall(("exit " + str(rc) + "\n").encode())
+            finally:
+                os._exit(rc)
+
+
+class DaemonClient:
+    forwarded_signals = [signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT]
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.remote_pid = None
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            return None
+        return sock
+
+    def send(self, sock, request, fds=None):
+        payload = (json.dumps(request) + "\n").encode()
+        ancdata = []
+        if fds:
+            ancdata = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))]
+        sent = sock.sendmsg([payload], ancdata)
+        if sent < len(payload):
+            sock.sendall(payload[sent:])
+
+    @staticmethod
+    def read_lines(sock):
+        buffer = b""
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                yield line.decode()
+
+    def control(self, command):
+        sock = self.connect()
+        if sock is None:
+            return None
+        try:
+            self.send(sock, {"command": command})
+            for line in self.read_lines(sock):
+                return line
+        finally:
+            sock.close()
+        return None
+
+    def status(self, quiet=False):
+        response = self.control("status")
+        if not quiet:
+            if response is None:
+                print("Daemon: not running")
+            else:
+                print("Daemon: running (pid " + response.split(" ")[1] + ")")
+        return response is not None
+
+    def stop(self):
+        if self.control("stop") is None:
+            print("Daemon: not running")
+            return False
+        return True
+
+    def forward_signal(self, signum, frame):
+        if self.remote_pid is not None:
+            try:
+                os.kill(self.remote_pid, signum)
+            except OSError:
+                pass
+
+    # returns None when no daemon is listening, so the caller can fall back to a regular run
+    def run(self, argv):
+        sock = self.connect()
+        if sock is None:
+            return None
+        for signum in DaemonClient.forwarded_signals:
+            signal.signal(signum, self.forward_signal)
+        try:
+            self.send(sock, {"command": "run", "argv": argv, "env": dict(os.environ), "cwd": os.getcwd()},
+                      fds=[0, 1, 2])
+            for line in self.read_lines(sock):
+                tokens = line.split(" ")
+                if tokens[0] == "pid":
+                    self.remote_pid = int(tokens[1])
+                elif tokens[0] == "exit":
+                    return int(tokens[1])
+        finally:
+            sock.close()
+        print("Daemon: connection lost before the command finished", file=sys.stderr)
+        return 255
@@ -5,10 +5,6 @@ class Graph:
         self.node_count = 0
         self.adj_list = {}
         self.inv_adj_list = {}
-        self.dfs_current_run = 0
-
-        self.visited = {}
-        self.dfs_current_path = []
 
     def add_node(self, node):
         node = node.upper()
@@ -39,6 +35,18 @@ class Graph:
             self.inv_adj_list[to_node_id] = set()
         self.inv_adj_list[to_node_id].add(from_node_id)
 
+    def get_dependencies(self, node):
+        node_id = self.get_node_id(node)
+        if node_id not in self.inv_adj_list:
+            return []
+        return [self.id_to_name[other_node_id] for other_node_id in self.inv_adj_list[node_id]]
+
+    def get_dependents(self, node):
+        node_id = self.get_node_id(node)
+        if node_id not in self.adj_list:
+            return []
+        return [self.id_to_name[other_node_id] for other_node_id in self.adj_list[node_id]]
+
     def exists_node(self, node):
         return self.get_node_id(node) != 0
 
@@ -81,52 +89,209 @@ class Graph:
             self.inv_adj_list[other_node_id].remove(node_id)
         self.adj_list[node_id] = set()
 
-    def _dfs_check_for_cycle(self, node_id):
-        self.dfs_current_path.append(self.id_to_name[node_id])
-        self.visited[node_id] = self.dfs_current_run
-        if node_id in self.adj_list:
-            for neighbour_node_id in self.adj_list[node_id]:
-                if neighbour_node_id in self.visited:
-                    if self.dfs_current_run != self.visited[neighbour_node_id]:
-                        return True
-                elif self._dfs_check_for_cycle(neighbour_node_id):
-                    return True
-        self.dfs_current_path.pop()
-        return False
+    # iterative Tarjan, every node and edge is visited once
+    def get_strongly_connected_components(self):
+        index = {}
+        low_link = {}
+        on_stack = set()
+        stack = []
+        components = []
+        next_index = 0
+        for root_id in self.id_to_name:
+            if root_id in index:
+                continue
+            index[root_id] = low_link[root_id] = next_index
+            next_index += 1
+            stack.append(root_id)
+            on_stack.add(root_id)
+            work = [(root_id, iter(self.adj_list.get(root_id, ())))]
+            while work:
+                node_id, neighbours = work[-1]
+                pushed = False
+                for neighbour_node_id in neighbours:
+                    if neighbour_node_id not in index:
+                        index[neighbour_node_id] = low_link[neighbour_node_id] = next_index
+                        next_index += 1
+                        stack.append(neighbour_node_id)
+                        on_stack.add(neighbour_node_id)
+                        work.append((neighbour_node_id, iter(self.adj_list.get(neighbour_node_id, ()))))
+                        pushed = True
+                        break
+                    elif neighbour_node_id in on_stack:
+                        low_link[node_id] = min(low_link[node_id], index[neighbour_node_id])
+                if pushed:
+                    continue
+                work.pop()
+                if work:
+                    parent_id = work[-1][0]
+                    low_link[parent_id] = min(low_link[parent_id], low_link[node_id])
+                if low_link[node_id] == index[node_id]:
+                    component = []
+                    while True:
+                        other_node_id = stack.pop()
+                        on_stack.discard(other_node_id)
+                        component.append(other_node_id)
+                        if other_node_id == node_id:
+                            break
+                    components.append(component)
+        return components
+
+    def _is_cyclic_component(self, component):
+        if len(component) > 1:
+            return True
+        node_id = component[0]
+        return node_id in self.adj_list and node_id in self.adj_list[node_id]
+
+    # shortest cycle through the first node of a strongly connected component, closed by repeating that node
+    def _get_component_cycle(self, component):
+        members = set(component)
+        start_id = component[0]
+        parents = {start_id: None}
+        queue = [start_id]
+        for node_id in queue:
+            for neighbour_node_id in self.adj_list.get(node_id, ()):
+                if neighbour_node_id == start_id:
+                    path = [start_id]
+                    while node_id is not None:
+                        path.append(node_id)
+                        node_id = parents[node_id]
+                    path.reverse()
+                    return [self.id_to_name[path_node_id] for path_node_id in path]
+                if neighbour_node_id in members and neighbour_node_id not in parents:
+                    parents[neighbour_node_id] = node_id
+                    queue.append(neighbour_node_id)
+        return [self.id_to_name[node_id] for node_id in component]
+
+    def get_cycles(self):
+        cycles = []
+        for component in self.get_strongly_connected_components():
+            if self._is_cyclic_component(component):
+                cycles.append(self._get_component_cycle(component))
+        return cycles
 
     def check_for_cycle(self):
-        self.dfs_current_run = 0
-        for node_name, node_id in self.name_to_id.items():
-            self.visited = {}
-            self.dfs_current_path = []
-            self.dfs_current_run += 1
-            if self._dfs_check_for_cycle(node_id):
-                return self.dfs_current_path
+        cycles = self.get_cycles()
+        if cycles:
+            return cycles[0]
         return []
 
-    def _dfs_topo_sort(self, node_id):
-        self.visited[node_id] = 1
-        if node_id in self.inv_adj_list:
-            for neighbour_node_id in self.inv_adj_list[node_id]:
-                if neighbour_node_id not in self.visited:
-                    self._dfs_topo_sort(neighbour_node_id)
-        self.dfs_current_path.append(self.id_to_name[node_id])
+    # iterative post-order DFS over the dependencies, same order as the recursive version without its depth limit
+    def _dfs_topo_sort(self, root_id, visited, result):
+        visited.add(root_id)
+        work = [(root_id, iter(self.inv_adj_list.get(root_id, ())))]
+        while work:
+            node_id, neighbours = work[-1]
+            for neighbour_node_id in neighbours:
+                if neighbour_node_id not in visited:
+                    visited.add(neighbour_node_id)
+                    work.append((neighbour_node_id, iter(self.inv_adj_list.get(neighbour_node_id, ()))))
+                    break
+            else:
+                work.pop()
+                result.append(self.id_to_name[node_id])
 
     def topo_sort(self, node):
         node_id = self.get_node_id(node)
         if node_id == -1:
             return []
-        self.visited = {}
-        self.dfs_current_path = []
-        self._dfs_topo_sort(node_id)
-        return self.dfs_current_path
+        result = []
+        self._dfs_topo_sort(node_id, set(), result)
+        return result
 
     def topo_sort_all(self):
-        self.visited = {}
+        visited = set()
         result = []
         for node_id in self.id_to_name:
-            if node_id not in self.visited:
-                self.dfs_current_path = []
-                self._dfs_topo_sort(node_id)
-                result.extend(self.dfs_current_path)
+            if node_id not in visited:
+                self._dfs_topo_sort(node_id, visited, result)
         return result
+
+    def compile(self):
+        return CompiledGraph.from_graph(self)
+
+
+def iter_bits(bitset):
+    while bitset:
+        lowest_bit = bitset & -bitset
+        yield lowest_bit.bit_length() - 1
+        bitset ^= lowest_bit
+
+
+# read-only snapshot of a DAG: node ids follow Graph.topo_sort_all, adjacency is kept in lists and the transitive
+# closures are int bitsets, so closure queries do not traverse the graph and their results come out topo-sorted
+class CompiledGraph:
+    def __init__(self, names, dependencies):
+        self.names = names
+        self.ids = {name: node_id for node_id, name in enumerate(names)}
+        self.dependencies = dependencies
+        self.dependents = [[] for _ in names]
+        for node_id, node_dependencies in enumerate(dependencies):
+            for dependency_id in node_dependencies:
+                self.dependents[dependency_id].append(node_id)
+
+        self.ancestors = [0] * len(names)
+        for node_id, node_dependencies in enumerate(dependencies):
+            for dependency_id in node_dependencies:
+                self.ancestors[node_id] |= self.ancestors[dependency_id] | (1 << dependency_id)
+        self.descendants = [0] * len(names)
+        for node_id in reversed(range(len(names))):
+            for dependent_id in self.dependents[node_id]:
+                self.descendants[node_id] |= self.descendants[dependent_id] | (1 << dependent_id)
+
+    @classmethod
+    def from_graph(cls, graph):
+        names = graph.topo_sort_all()
+        ids = {name: node_id for node_id, name in enumerate(names)}
+        dependencies = []
+        for name in names:
+            dependencies.append(sorted(ids[dependency] for dependency in graph.get_dependencies(name)))
+        return cls(names, dependencies)
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(data["names"], data["dependencies"])
+
+    def to_data(self):
+        return {"names": self.names, "dependencies": self.dependencies}
+
+    def get_node_id(self, node):
+        return self.ids.get(node.upper(), -1)
+
+    def get_topo_order(self):
+        return list(self.names)
+
+    def get_mask(self, nodes):
+        mask = 0
+        for node in nodes:
+            node_id = self.get_node_id(node)
+            if node_id != -1:
+                mask |= 1 << node_id
+        return mask
+
+    def get_names(self, mask):
+        return [self.names[node_id] for node_id in iter_bits(mask)]
+
+    def get_ancestors_mask(self, nodes, include_self=False):
+        mask = 0
+        for node in nodes:
+            node_id = self.get_node_id(node)
+            if node_id == -1:
+                continue
+            mask |= self.ancestors[node_id]
+            if include_self:
+                mask |= 1 << node_id
+        return mask
+
+    def get_descendants_mask(self, nodes, include_self=False):
+        mask = 0
+        for node in nodes:
+            node_id = self.get_node_id(node)
+            if node_id == -1:
+                continue
+            mask |= self.descendants[node_id]
+            if include_self:
+                mask |= 1 << node_id
+        return mask
+
+    def get_full_dependencies(self, node, include_self=True):
+        return self.get_names(self.get_ancestors_mask([node], include_self=include_self))
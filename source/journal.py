@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import socket
+import threading
+from time import localtime, strftime
+
+from util import print_help_line
+
+JOURNAL_FILE = "journal.jsonl"
+# the journal is moved to journal.jsonl.1 (replacing the previous one) once it grows over this size
+JOURNAL_MAX_SIZE = 16 * 1024 * 1024
+
+
+def get_percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    index = max(0, int(len(sorted_values) * percentile / 100.0 + 0.5) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    return "{:.2f}s".format(seconds)
+
+
+# append-only JSON lines record of what Daedalus ran: module scripts ("script"), module actions made of several
+# scripts ("action") and plugin commands ("plugin"), with their start and end time, rc, project and host. Shared by
+# all the projects of an install, a failing write never fails the command that is journaled
+class Journal:
+    lock = threading.Lock()
+    host = None
+
+    @staticmethod
+    def get_path(global_state_path):
+        return os.path.join(global_state_path, JOURNAL_FILE)
+
+    @classmethod
+    def get_host(cls):
+        if cls.host is None:
+            cls.host = socket.gethostname()
+        return cls.host
+
+    @classmethod
+    def append(cls, global_state_path, kind, command, start_time, rc, project=None, module=None, namespace=None,
+               end_time=None, **extra):
+        entry = {
+            "kind": kind,
+            "command": command,
+            "project": project,
+            "module": module,
+            "namespace": namespace,
+            "start": round(start_time, 3),
+            "end": round(end_time if end_time is not None else time.time(), 3),
+            "rc": rc,
+            "host": cls.get_host()
+        }
+        entry.update(extra)
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        path = cls.get_path(global_state_path)
+        with cls.lock:
+            try:
+                os.makedirs(global_state_path, exist_ok=True)
+                if os.path.exists(path) and os.path.getsize(path) > JOURNAL_MAX_SIZE:
+                    os.replace(path, path + ".1")
+                # a single small O_APPEND write, so concurrent Daedalus processes do not interleave entries
+                with open(path, "a") as journal_file:
+                    journal_file.write(line)
+            except OSError:
+                pass
+
+    @classmethod
+    def load(cls, global_state_path):
+        entries = []
+        path = cls.get_path(global_state_path)
+        for journal_path in [path + ".1", path]:
+            try:
+                with open(journal_path) as journal_file:
+                    for line in journal_file:
+                        try:
+                            entries.append(json.loads(line))
+                        except ValueError:
+                            # a line cut by a crash, the next ones are still fine
+                            continue
+            except OSError:
+                continue
+        return entries
+
+    @staticmethod
+    def get_entry_name(entry):
+        if entry.get("module") is None:
+            return entry["command"]
+        return entry["module"] + " " + entry["command"]
+
+    @classmethod
+    def get_history(cls, global_state_path, project=None, module=None, command=None, top=10):
+        entries = []
+        for entry in cls.load(global_state_path):
+            if project is not None and entry.get("project") not in [project, None]:
+                continue
+            if module is not None and entry.get("module") != module:
+                continue
+            if command is not None and entry.get("command") != command:
+                continue
+            entries.append(entry)
+
+        groups = {}
+        for entry in entries:
+            key = (entry["kind"], cls.get_entry_name(entry))
+            groups.setdefault(key, []).append(entry)
+        stats = []
+        for (kind, name), group in groups.items():
+            durations = sorted(entry["end"] - entry["start"] for entry in group)
+            failures = len([entry for entry in group if entry["rc"] != 0])
+            stats.append({
+                "kind": kind,
+                "name": name,
+                "runs": len(group),
+                "p50": get_percentile(durations, 50),
+                "p95": get_percentile(durations, 95),
+                "max": durations[-1],
+                "total": sum(durations),
+                "failures": failures,
+                "failureRate": failures / float(len(group)),
+                "lastRun": max(entry["start"] for entry in group)
+            })
+        stats.sort(key=lambda stat: (-stat["p95"], stat["name"]))
+
+        slowest = sorted((entry for entry in entries if entry["kind"] == "script"),
+                         key=lambda entry: entry["start"] - entry["end"])[:top]
+        return {
+            "entries": len(entries),
+            "slowest": slowest,
+            "stats": stats
+        }
+
+    @staticmethod
+    def print_history(history):
+        if not history["entries"]:
+            print("History: no journaled runs yet")
+            return
+        print("Slowest script runs:")
+        for entry in history["slowest"]:
+            name = Journal.get_entry_name(entry)
+            if entry.get("namespace"):
+                name += " (#" + entry["namespace"] + ")"
+            print_help_line(1, name, format_seconds(entry["end"] - entry["start"]) + ", rc " + str(entry["rc"]) +
+                            ", " + strftime("%Y-%m-%d %H:%M:%S", localtime(entry["start"])) + " on " +
+                            entry["host"], col1_size=40)
+        print("")
+        print("Runs by module command (" + str(history["entries"]) + " journaled):")
+        print_help_line(1, "name", "runs      p50      p95      max  failures", col1_size=40, col_separator="   ")
+        for stat in history["stats"]:
+            name = stat["name"] + ("" if stat["kind"] == "script" else " [" + stat["kind"] + "]")
+            print_help_line(1, name, "{:>4} {:>8} {:>8} {:>8} {:>9}".format(
+                stat["runs"], format_seconds(stat["p50"]), format_seconds(stat["p95"]), format_seconds(stat["max"]),
+                "{:.0%}".format(stat["failureRate"])), col1_size=40, col_separator="   ")
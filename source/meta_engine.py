@@ -1,11 +1,15 @@
 import os
 
 import config
-import plugins.autossh
 from util import load_json, ensure_json_exists, get_dirs_in, get_files_in, ensure_password, format_two_column, run, print_help_line
+from util import get_script_command, is_shell_exec_mode
 from module import Module
+from module_index import ModuleIndex, get_stamp
 from configfs import ConfigFS
-from graph import Graph
+from graph import Graph, CompiledGraph
+from plugin_registry import PluginRegistry
+from profiler import Profiler
+from scheduler import Scheduler
 
 
 class MetaEngine:
@@ -20,9 +24,13 @@ class MetaEngine:
         self.configfs_path = os.path.join(self.project_state_path, "configfs")
         self.configfs = ConfigFS(self.configfs_path)
         self.dependencies_graph = Graph()
+        self.compiled_graph = None
 
         self.config_plugin_db = os.path.join(self.env["DAEDALUS_GLOBAL_STATE_PATH"], "config_plugins.json")
         self.config_plugins = {}
+        self.module_list_stamps = {}
+        self.signature = {}
+        self.module_index_path = os.path.join(self.project_state_path, "module-index.json")
 
         self.reload()
 
@@ -46,13 +54,26 @@ class MetaEngine:
     def filter_installed_modules(configfs_vars):
        return installed_modules
 
-    def update_all(self, soft=True):
+    def update_all(self, soft=True, selection=None):
         if soft:
-            self.exec_on_all("update")
-        else:
-            self.exec_on_all("stop")
-            self.exec_on_all("reinstall")
-            self.exec_on_all("start")
+            return self.exec_bulk("update", selection=selection)
+        return self.exec_bulk("update-version", selection=selection)
+
+    # modules targeted by a bulk command limited to part of the graph, in topological order
+    def get_selection(self, module_names, with_dependents=False, with_dependencies=False):
+        mask = self.compiled_graph.get_mask(module_names)
+        if with_dependents:
+            mask |= self.compiled_graph.get_descendants_mask(module_names)
+        if with_dependencies:
+            mask |= self.compiled_graph.get_ancestors_mask(module_names)
+        return self.compiled_graph.get_names(mask)
+
+    @staticmethod
+    def filter_selection(module_names, selection):
+        if selection is None:
+            return module_names
+        selection = set(module_name.upper() for module_name in selection)
+        return [module_name for module_name in module_names if module_name.upper() in selection]
 
     def get_bulk_command_filter(self, filter_as):
         command_filters = []
@@ -67,8 +88,8 @@ class MetaEngine:
             final_command_filters.append(command_filter.upper())
         return final_command_filters
 
-    def exec_on_all(self, command, filter_as=None):
-        module_names = self.sorted_by_command_priority_installed_modules(command)
+    def get_bulk_modules(self, command, filter_as=None, selection=None):
+        module_names = self.filter_selection(self.sorted_by_command_priority_installed_modules(command), selection)
         if not filter_as:
             filter_as = []
         filter_as.append(command)
@@ -77,33 +98,207 @@ class MetaEngine:
         for module_name in module_names:
             if module_name.upper() not in command_filter:
                 filtered_module_names.append(module_name)
-        self.exec_in_order(filtered_module_names, command)
+        return filtered_module_names
 
-    def exec_reversed_on_all(self, command, filter_as=None):
-        module_names = self.sorted_by_command_priority_installed_modules(command)
+    def exec_on_all(self, command, filter_as=None, selection=None):
+        return self.exec_in_order(self.get_bulk_modules(command, filter_as, selection), command)
+
+    def exec_reversed_on_all(self, command, filter_as=None, selection=None):
+        module_names = self.get_bulk_modules(command, filter_as, selection)
         module_names.reverse()
-        if not filter_as:
-            filter_as = []
-        filter_as.append(command)
-        command_filter = self.get_bulk_command_filter(filter_as)
-        filtered_module_names = []
+        return self.exec_in_order(module_names, command, reverse=True)
+
+    # groups of modules linked by dependencies, each group in the order of module_names
+    def get_connected_groups(self, module_names):
+        module_mask = self.compiled_graph.get_mask(module_names)
+        order = {name: index for index, name in enumerate(module_names)}
+        group_of = {}
+        groups = []
         for module_name in module_names:
-            if module_name.upper() not in command_filter:
-                filtered_module_names.append(module_name)
-        self.exec_in_order(filtered_module_names, command)
-
-    def exec_in_order(self, module_names, command):
+            if module_name in group_of:
+                continue
+            group = []
+            stack = [module_name]
+            group_of[module_name] = group
+            while stack:
+                node = stack.pop()
+                group.append(node)
+                linked_mask = self.compiled_graph.get_ancestors_mask([node]) | \
+                    self.compiled_graph.get_descendants_mask([node])
+                for other in self.compiled_graph.get_names(linked_mask & module_mask):
+                    if other not in group_of:
+                        group_of[other] = group
+                        stack.append(other)
+            group.sort(key=lambda name: order[name])
+            groups.append(group)
+        return groups
+
+    # restart pipelined per group of linked modules instead of stopping everything then starting everything: a
+    # module is stopped once its dependents are stopped and started again as soon as its dependencies are back, so
+    # its downtime only covers its own restart and the one of its dependencies. Script priorities only set the
+    # order in which the groups are handled here, they are not barriers.
+    def get_restart_scheduler(self, stop_command="sync-stop", filter_as=None, selection=None):
+        stop_names = [name.upper() for name in self.get_bulk_modules(stop_command, list(filter_as or []), selection)]
+        start_names = [name.upper() for name in self.get_bulk_modules("start", list(filter_as or []), selection)]
+        stop_mask = self.compiled_graph.get_mask(stop_names)
+        start_mask = self.compiled_graph.get_mask(start_names)
+        module_names = list(dict.fromkeys(start_names + stop_names))
+
+        scheduler = Scheduler(jobs=self.get_jobs(), keep_going=False)
+        task_names = {module_name: self.get_namespace_task_names(module_name) for module_name in module_names}
+        for group in self.get_connected_groups(module_names):
+            for module_name in reversed(group):
+                if not self.compiled_graph.get_mask([module_name]) & stop_mask:
+                    continue
+                dependents_mask = self.compiled_graph.get_descendants_mask([module_name]) & stop_mask
+                dependencies = ["stop:" + task_name for name in self.compiled_graph.get_names(dependents_mask)
+                                for task_name in task_names[name]]
+                self.add_namespace_tasks(scheduler, module_name, stop_command, dependencies, prefix="stop:")
+            for module_name in group:
+                if not self.compiled_graph.get_mask([module_name]) & start_mask:
+                    continue
+                # never start before the module itself or one of its dependencies is stopped
+                ancestors_mask = self.compiled_graph.get_ancestors_mask([module_name], include_self=True)
+                started_first = [name for name in self.compiled_graph.get_names(ancestors_mask & start_mask)
+                                 if name != module_name]
+                stopped_first = self.compiled_graph.get_names(ancestors_mask & stop_mask)
+                dependencies = ["start:" + task_name for name in started_first for task_name in task_names[name]]
+                dependencies += ["stop:" + task_name for name in stopped_first for task_name in task_names[name]]
+                self.add_namespace_tasks(scheduler, module_name, "start", dependencies, prefix="start:")
+        return scheduler
+
+    def restart_all(self, stop_command="sync-stop", filter_as=None, selection=None):
+        return self.run_scheduler(self.get_restart_scheduler(stop_command, filter_as, selection), "restart")
+
+    # one task per module and namespace, recursive commands run on the union of the dependency closures of all
+    # the targets so shared dependencies are handled once; a task waits for the tasks of its dependencies
+    def get_module_exec_scheduler(self, names, command, params=None):
+        targets = []
+        for name in names:
+            module = self.module(name)
+            if module.is_recursive(command):
+                dependencies, namespace = self.get_full_dependencies(name)
+                for dependence_name in dependencies:
+                    dependence = self.module(dependence_name)
+                    dependence_namespace = None
+                    if dependence.is_install_script(command) or namespace in dependence.available_namespaces:
+                        dependence_namespace = namespace
+                    targets.append((dependence.get_name().upper(), dependence_namespace))
+            else:
+                targets.append((module.get_name().upper(), module.namespace))
+        targets = list(dict.fromkeys(targets))
+        order = {target: index for index, target in enumerate(targets)}
+        targets.sort(key=lambda target: (self.compiled_graph.get_node_id(target[0]), order[target]))
+
+        task_names = {}
+        for module_name, namespace in targets:
+            task_names.setdefault(module_name, []).append(
+                self.module(module_name).for_namespace(namespace).get_full_name())
+        scheduler = Scheduler(jobs=self.get_jobs(), keep_going=False)
+        for module_name, namespace in targets:
+            target_module = self.module(module_name).for_namespace(namespace)
+            if target_module.get_namespace_concurrency() is not None:
+                scheduler.set_limit(module_name, target_module.get_namespace_concurrency())
+            dependencies = []
+            for dependence_name in self.compiled_graph.get_full_dependencies(module_name, include_self=False):
+                dependencies += task_names.get(dependence_name, [])
+            scheduler.add_task(target_module.get_full_name(),
+                               lambda target_module=target_module: target_module.run(command, params=params),
+                               dependencies=dependencies, group=module_name,
+                               data={"module": module_name, "command": command, "namespace": namespace,
+                                     "params": params})
+        return scheduler
+
+    # the schedulers a bulk command runs one after the other, as [command, scheduler] pairs
+    def get_bulk_schedulers(self, command, selection=None):
+        if command in ["update", "start", "stop", "sync-stop"]:
+            return [[command, self.get_exec_scheduler(self.get_bulk_modules(command, selection=selection), command)]]
+        elif command == "update-version":
+            return [[step, self.get_exec_scheduler(self.get_bulk_modules(step, selection=selection), step)]
+                    for step in ["stop", "reinstall", "start"]]
+        elif command == "restart":
+            return [[command, self.get_restart_scheduler("sync-stop", filter_as=["restart"], selection=selection)]]
+        elif command == "force-restart":
+            return [[command, self.get_restart_scheduler("force-stop", selection=selection)]]
+        return []
+
+    # stops at the first step that failed and returns its result, the one of the last step otherwise
+    def exec_bulk(self, command, selection=None):
+        result = None
+        for step, scheduler in self.get_bulk_schedulers(command, selection):
+            result = self.run_scheduler(scheduler, step)
+            if result.get_rc() != 0:
+                break
+        return result
+
+    def get_jobs(self):
+        jobs = os.environ.get("DAEDALUS_JOBS")
+        if jobs is None:
+            jobs = self.get_config_key("option-bulk-jobs")
+        try:
+            return max(1, int(jobs))
+        except (TypeError, ValueError):
+            return 1
+
+    # modules of the list a module has to wait for, including the ones reached through modules outside of it
+    def get_scheduled_dependencies(self, module_name, module_mask, reverse=False):
+        if reverse:
+            mask = self.compiled_graph.get_descendants_mask([module_name])
+        else:
+            mask = self.compiled_graph.get_ancestors_mask([module_name])
+        return self.compiled_graph.get_names(mask & module_mask)
+
+    def get_namespace_task_names(self, module_name):
+        return [module_name if namespace in [None, "<this>"] else module_name + "#" + namespace
+                for namespace in self.module(module_name).available_namespaces]
+
+    # one task per installed namespace of the module, they share the scheduler's workers with every other module
+    # and take at most get_namespace_concurrency() of them (one for singletons)
+    def add_namespace_tasks(self, scheduler, module_name, command, dependencies, barrier=0, prefix=""):
+        module = self.module(module_name)
+        concurrency = module.get_namespace_concurrency()
+        if concurrency is not None:
+            scheduler.set_limit(module_name, concurrency)
+        task_names = self.get_namespace_task_names(module_name)
+        for namespace, task_name in zip(module.available_namespaces, task_names):
+            namespace_module = module.for_namespace(namespace)
+            scheduler.add_task(prefix + task_name,
+                               lambda namespace_module=namespace_module: namespace_module.run(command),
+                               dependencies=dependencies, barrier=barrier, group=module_name,
+                               data={"module": module_name, "command": command, "namespace": namespace,
+                                     "params": None})
+
+    # independent modules and the namespaces of a module run concurrently on up to get_jobs() workers, script
+    # priorities act as barriers
+    def get_exec_scheduler(self, module_names, command, reverse=False):
+        module_names = [module_name.upper() for module_name in module_names]
+        module_mask = self.compiled_graph.get_mask(module_names)
+        task_names = {module_name: self.get_namespace_task_names(module_name) for module_name in module_names}
+        scheduler = Scheduler(jobs=self.get_jobs(), keep_going=False)
         for module_name in module_names:
-            module = self.module(module_name)
-            for namespace in module.available_namespaces:
-                module.set_namespace(namespace)
-                module.run(command)
+            dependencies = [task_name for name in self.get_scheduled_dependencies(module_name, module_mask, reverse)
+                            for task_name in task_names[name]]
+            self.add_namespace_tasks(scheduler, module_name, command, dependencies,
+                                     barrier=self.get_priority(module_name, command))
+        return scheduler
+
+    @staticmethod
+    def run_scheduler(scheduler, command):
+        result = scheduler.run()
+        failed = result.get_failed()
+        if failed:
+            print("Error: command \"" + command + "\" failed for modules: " + str(failed) +
+                  (", skipped " + str(result.get_skipped()) if result.get_skipped() else ""))
+        return result
+
+    def exec_in_order(self, module_names, command, reverse=False):
+        return self.run_scheduler(self.get_exec_scheduler(module_names, command, reverse=reverse), command)
 
     def startup(self):
         autossh_on_boot = self.get_config_key("autossh-on-boot")
         if autossh_on_boot is not None:
             if autossh_on_boot.upper() == "TRUE":
-                autossh = plugins.autossh.AutoSSHManager()
+                autossh = PluginRegistry.load_module("autossh").AutoSSHManager()
                 autossh.load()
                 autossh.apply()
 
@@ -125,9 +320,11 @@ class MetaEngine:
 
     def load_module_list(self):
         config_path = self.env["DAEDALUS_CONFIG_MODULES_PATH"]
+        self.module_list_stamps = {config_path: get_stamp(config_path)}
         modules = [name.lower() for name in get_dirs_in(config_path)]
 
         ensure_json_exists(self.config_plugin_db)
+        self.module_list_stamps[self.config_plugin_db] = get_stamp(self.config_plugin_db)
         config_plugins_data = load_json(self.config_plugin_db)
         for config_plugin_name in config_plugins_data:
             config_plugin_data = config_plugins_data[config_plugin_name]
@@ -137,6 +334,7 @@ class MetaEngine:
                 continue
             self.config_plugins[config_plugin_name] = config_plugin_data
             modules_path = os.path.join(config_plugin_data["path"], "modules")
+            self.module_list_stamps[modules_path] = get_stamp(modules_path)
             modules += [config_plugin_name + "." + name.lower() for name in get_dirs_in(modules_path)]
         modules = self.filter_modules_by_name(modules)
         return modules
@@ -189,6 +387,17 @@ class MetaEngine:
         self.installed_modules = installed_modules
         return installed_modules
 
+    def refresh_installed_modules(self):
+        for module_name in self.modules:
+            self.modules[module_name].available_namespaces = []
+        return self.load_installed_modules()
+
+    def get_signature(self):
+        return {path: get_stamp(path) for path in self.signature}
+
+    def is_stale(self):
+        return self.get_signature() != self.signature
+
     @classmethod
     def sort_modules(cls, modules, order):
         ordered_modules = []
@@ -206,7 +415,7 @@ class MetaEngine:
 
     def order_by_command_priority(self, command):
         ordered_modules = []
-        graph_order = self.dependencies_graph.topo_sort_all()
+        graph_order = self.compiled_graph.get_topo_order()
         sorted_modules = []
         index = 0
         for module in graph_order:
@@ -219,43 +428,81 @@ class MetaEngine:
 
     def sorted_installed_modules(self):
         return MetaEngine.sort_modules(self.get_installed_modules(),
-                                       self.dependencies_graph.topo_sort_all())
+                                       self.compiled_graph.get_topo_order())
 
     def sorted_by_command_priority_installed_modules(self, command):
         return MetaEngine.sort_modules(self.get_installed_modules(),
                                        self.order_by_command_priority(command))
 
     def reload(self):
-        self.module_names = self.load_module_list()
-        for module_name in self.module_names:
-            config_path, config_modules_dir, config_module_dir = self.get_module_data(module_name)
-            self.modules[module_name] = Module(module_name, self.root_dir, env=self.env,
-                                            custom_config_path=config_path,
-                                            custom_config_modules_dir=config_modules_dir,
-                                            custom_config_module_dir=config_module_dir)
-        
-        self.load_installed_modules()
-
-        for module_name in self.module_names:
-            self.dependencies_graph.add_node(module_name)
-
-        for module_name in self.module_names:
-            module_dependencies = self.modules[module_name].get_dependencies()
-            for module_dependence in module_dependencies:
-                self.dependencies_graph.add_edge(module_dependence, module_name)
-
-        for module_name in self.module_names:
-            module_dependencies = self.modules[module_name].get_dependencies()
-            for module_dependence in module_dependencies:
-                if module_dependence not in self.module_names:
-                    print("Error: invalid configuration! Module \"" + module_name +
-                          "\" depends on invalid module \"" + module_dependence + "\"")
-                    exit(1)
-
-        cycle = self.dependencies_graph.check_for_cycle()
-        if cycle:
+        module_index = ModuleIndex(self.module_index_path)
+        with Profiler.phase("module list"):
+            module_list = module_index.get_module_list()
+            if module_list is None:
+                self.module_names = self.load_module_list()
+                module_index.set_module_list(self.module_names, self.config_plugins, self.module_list_stamps)
+            else:
+                self.module_names, self.config_plugins = module_list
+                self.module_list_stamps = module_index.module_list["stamps"]
+
+        signature = dict(self.module_list_stamps)
+        with Profiler.phase("description parsing"):
+            for module_name in self.module_names:
+                config_path, config_modules_dir, config_module_dir = self.get_module_data(module_name)
+                description_path = os.path.join(config_module_dir, "description.json")
+                stamp = get_stamp(description_path)
+                desc = module_index.get_description(description_path, stamp)
+                self.modules[module_name] = Module(module_name, self.root_dir, env=self.env,
+                                                custom_config_path=config_path,
+                                                custom_config_modules_dir=config_modules_dir,
+                                                custom_config_module_dir=config_module_dir,
+                                                desc=desc)
+                if desc is None:
+                    module_index.set_description(description_path, self.modules[module_name].get_description(), stamp)
+                signature[description_path] = stamp
+            module_index.prune(signature)
+
+        with Profiler.phase("installed modules"):
+            self.load_installed_modules()
+
+        with Profiler.phase("graph build"):
+            for module_name in self.module_names:
+                self.dependencies_graph.add_node(module_name)
+
+            for module_name in self.module_names:
+                module_dependencies = self.modules[module_name].get_dependencies()
+                for module_dependence in module_dependencies:
+                    self.dependencies_graph.add_edge(module_dependence, module_name)
+
+        # an unchanged index was already validated by the run that saved it
+        if module_index.changed:
+            self.check_module_graph()
+        with Profiler.phase("graph compile"):
+            if module_index.changed or module_index.compiled_graph is None:
+                self.compiled_graph = self.dependencies_graph.compile()
+                module_index.set_compiled_graph(self.compiled_graph.to_data())
+            else:
+                self.compiled_graph = CompiledGraph.from_data(module_index.compiled_graph)
+        module_index.save()
+
+        self.signature = signature
+
+    def check_module_graph(self):
+        with Profiler.phase("dependency check"):
+            for module_name in self.module_names:
+                module_dependencies = self.modules[module_name].get_dependencies()
+                for module_dependence in module_dependencies:
+                    if module_dependence not in self.module_names:
+                        print("Error: invalid configuration! Module \"" + module_name +
+                              "\" depends on invalid module \"" + module_dependence + "\"")
+                        exit(1)
+
+        with Profiler.phase("cycle check"):
+            cycles = self.dependencies_graph.get_cycles()
+        if cycles:
             print("Error: invalid configuration! There is a cycle in the dependencies graph!")
-            print("Cycle: " + str(cycle))
+            for cycle in cycles:
+                print("Cycle: " + str(cycle))
             exit(1)
 
     def get_modules(self):
@@ -294,17 +541,21 @@ class MetaEngine:
             tokens = module_name.split("#")
             module_name = tokens[0].lower()
             namespace = tokens[1]
-        return self.dependencies_graph.topo_sort(module_name), namespace
+        return self.compiled_graph.get_full_dependencies(module_name), namespace
 
     def run_command(self, command, params=None):
-        params_line = ""
-        if params:
-            for param in params:
-                params_line += " " + param
-        final_command = "sudo -E " + self.root_dir + "/tools/bash/run_from_path.sh " + \
-                        self.env["DAEDALUS_PROJECT_PATH"] + " " + self.env["DAEDALUS_CONFIG_PATH"] + "/scripts/" + \
-                        command + params_line
-        return run(final_command, env=self.env)
+        script_path = self.env["DAEDALUS_CONFIG_PATH"] + "/scripts/" + command
+        if is_shell_exec_mode(self.get_config_key("option-exec-mode")):
+            params_line = ""
+            if params:
+                for param in params:
+                    params_line += " " + param
+            final_command = "sudo -E " + self.root_dir + "/tools/bash/run_from_path.sh " + \
+                            self.env["DAEDALUS_PROJECT_PATH"] + " " + script_path + params_line
+            return run(final_command, env=self.env)
+        argv = get_script_command(self.root_dir, self.env["DAEDALUS_PROJECT_PATH"], script_path,
+                                  params if params else [])
+        return run(argv, env=self.env, shell=False, cwd=self.env["DAEDALUS_PROJECT_PATH"])
 
     @staticmethod
     def print_configfs_help():
@@ -1,8 +1,13 @@
 import os
+import copy
+import hashlib
+import time
 import subprocess
 
-from util import load_json, get_files_in, run, escape_arg
+from util import load_json, get_files_in, run, run_in_process_group, get_script_command, is_shell_exec_mode
 from configfs import ConfigFS
+from module_descriptor import ModuleDescriptor
+from journal import Journal
 
 
 class Module:
@@ -10,7 +15,7 @@ class Module:
 
     def __init__(self, name, root_dir, env=None, custom_config_path=None,
                 custom_config_modules_dir=None, custom_config_module_dir=None,
-                namespace=None):
+                namespace=None, desc=None):
         self.namespace = None
         self.available_namespaces = []
 
@@ -55,8 +60,7 @@ class Module:
         self.env["DAEDALUS_MODULE_NAME"] = self.name
         
         self.desc = None
-
-        self.scripts = self.load_module_scripts()
+        self.descriptor = ModuleDescriptor({})
 
         self.version = None
         self.module = None
@@ -64,7 +68,10 @@ class Module:
         self.dependencies = None
 
         description_file = self.config_module_dir + "/description.json"
-        if not os.path.isfile(description_file):
+        if desc is not None:
+            # already parsed description, handed over from the module index
+            self.parse_description(desc)
+        elif not os.path.isfile(description_file):
             self.log("Error: Module \"" + self.name + "\" does not have a description file!")
         else:
             self.parse_description(load_json(description_file))
@@ -87,6 +94,7 @@ class Module:
 
     def parse_description(self, desc):
         self.desc = desc
+        self.descriptor = ModuleDescriptor(desc, self.config_plugin_name)
         if "version" not in self.desc:
             self.log("Error: Description of module \"" + self.name + "\" does not have a version field")
             return
@@ -124,7 +132,8 @@ class Module:
         return self.name
 
     def log(self, message):
-        print("<" + self.get_full_name() + ">: " + message)
+        # a single write keeps the line whole when bulk commands run modules from several threads
+        print("<" + self.get_full_name() + ">: " + message + "\n", end="", flush=True)
 
     def get_scripts(self):
         return self.scripts
@@ -143,32 +152,14 @@ class Module:
             return []
         return self.dependencies
 
-    @classmethod
-    def str_to_priority(cls, priority):
-        if type(priority) is int:
-            return priority
-        priority = priority.upper()
-        if priority == "FIRST":
-            return -500
-        elif priority == "LAST":
-            return 500
-        return 0
-
     def get_priority(self, command):
         script_data = self.search_script_by_alias(command)
         if script_data is None:
             return 0
-        if "priority" not in script_data:
-            return 0
-        return Module.str_to_priority(script_data["priority"])
+        return script_data.priority
 
     def search_script_by_alias(self, script):
-        for script_data in self.desc["scripts"]:
-            if "aliases" in script_data:
-                for alias in script_data["aliases"]:
-                    if alias == script:
-                        return script_data
-        return None
+        return self.descriptor.get_script(script)
 
     def check_dependencies(self, dependencies):
         for key in dependencies:
@@ -186,19 +177,29 @@ class Module:
             module_name = self.config_plugin_name + "." + module_name
         return self.config_fs.get(module_name + "-version") != self.desc["version"]
 
+    def journal(self, kind, command, start_time, rc, **extra):
+        Journal.append(self.env["DAEDALUS_GLOBAL_STATE_PATH"], kind, command, start_time, rc,
+                       project=self.env.get("DAEDALUS_PROJECT"), module=self.name, namespace=self.namespace, **extra)
+
     def purge(self):
+        start_time = time.time()
         self.config_fs.delete(self.desc["module"] + "-version")
+        self.clear_fingerprints()
         subprocess.call("rm -rf " + self.state_module_dir, shell=True)
+        rc = 0
         if self.search_script_by_alias("purge") is not None:
-            return self.run("purge", internal=True)
-        return 0
+            rc = self.run("purge", internal=True)
+        self.journal("action", "purge", start_time, rc)
+        return rc
 
     # TODO: error in state-modifying code is a bit tricky. 
     # No safeguards yet, so no need to treat reinstall carefully!
     def reinstall(self, force=False):
         if force or self.is_outdated():
+            start_time = time.time()
             self.run("purge")
-            self.run("install")
+            rc = self.run("install")
+            self.journal("action", "reinstall", start_time, rc)
         return 0
 
     def restart(self):
@@ -215,12 +216,18 @@ class Module:
 
     def startup(self):
         if self.search_script_by_alias("startup") is not None:
-            return self.run("startup", internal=True)
+            start_time = time.time()
+            rc = self.run("startup", internal=True)
+            self.journal("action", "startup", start_time, rc)
+            return rc
         return 0
 
     def shutdown(self):
         if self.search_script_by_alias("shutdown") is not None:
-            return self.run("shutdown", internal=True)
+            start_time = time.time()
+            rc = self.run("shutdown", internal=True)
+            self.journal("action", "shutdown", start_time, rc)
+            return rc
         return 0
 
     def info(self):
@@ -246,14 +253,25 @@ class Module:
         script_data = self.search_script_by_alias(script)
         if script_data is None:
             return False
-        if "isRecursive" not in script_data:
-            return False
-        return script_data["isRecursive"]
+        return script_data.is_recursive
 
     def is_singleton(self):
-        if "isSingleton" not in self.desc:
-            return False
-        return self.desc["isSingleton"]
+        return self.descriptor.is_singleton
+
+    # None when the description does not limit how many namespaces may run at the same time
+    def get_namespace_concurrency(self):
+        if self.is_singleton():
+            return 1
+        if self.descriptor.max_parallel_namespaces is None:
+            return None
+        return max(1, int(self.descriptor.max_parallel_namespaces))
+
+    # copy bound to a single namespace, run() writes to the namespace and the env so concurrent runs need their own
+    def for_namespace(self, namespace):
+        module = copy.copy(self)
+        module.env = self.env.copy()
+        module.set_namespace(namespace)
+        return module
 
     def set_namespace(self, namespace):
         if namespace == "<this>" or self.is_singleton():
@@ -265,9 +283,171 @@ class Module:
         script_data = self.search_script_by_alias(script)
         if script_data is None:
             return False
-        if "isInstallScript" not in script_data:
+        return script_data.is_install_script
+
+    def get_script_path(self, file_name):
+        return self.config_module_dir + "/scripts/" + file_name
+
+    # ConfigFS key and default value for each param spec of a script
+    def resolve_params(self, params):
+        resolved_params = []
+        if params is None:
+            return resolved_params
+        for param in params:
+            key = param.key
+            if param.use_namespace and self.namespace is not None:
+                if self.config_fs.exists(key + "#" + self.namespace):
+                    key += "#" + self.namespace
+            resolved_params.append((key, param.default))
+        return resolved_params
+
+    def get_log_path(self, script):
+        return os.path.join(self.env["DAEDALUS_STATE_PATH"], "logs", self.get_full_name(), script + ".log")
+
+    # DAEDALUS_CONSOLE: "prefix" (default) shows the script output prefixed by the module name and keeps a copy in
+    # the log of the module command, "quiet" only writes the log and "raw" hands the terminal to the script
+    def get_output_options(self, script, file_name):
+        console_mode = os.environ.get("DAEDALUS_CONSOLE", "prefix")
+        if console_mode == "raw":
+            return {}
+        return {
+            "tag": "<" + self.get_full_name() + "> ",
+            "log_path": self.get_log_path(script),
+            "log_header": self.get_full_name() + " " + script + " (" + file_name + ")",
+            "console": console_mode != "quiet"
+        }
+
+    def get_fingerprint_key(self, script_data):
+        key = self.name + "-" + str(script_data.file).replace("/", "_") + "-fingerprint-internal"
+        if self.namespace:
+            key += "#" + self.namespace
+        return key
+
+    # hash of everything a fingerprinted script run depends on: the script itself, its resolved params and extra
+    # arguments, the module version, the namespace and the declared input files (relative to the module dir)
+    def get_fingerprint(self, script_data, param_values, script_params=None):
+        fingerprint = hashlib.sha256()
+
+        def add(label, data):
+            if not isinstance(data, bytes):
+                data = str(data).encode()
+            fingerprint.update(label.encode() + b"\0" + str(len(data)).encode() + b"\0" + data)
+
+        def add_file(label, path):
+            try:
+                with open(path, "rb") as input_file:
+                    add(label + ":" + path, input_file.read())
+            except OSError:
+                add(label + ":" + path, "<missing>")
+
+        add_file("script", self.get_script_path(str(script_data.file)))
+        for key, value in param_values:
+            add("param:" + key, value)
+        for param in script_params if script_params else []:
+            add("arg", param)
+        add("version", self.version)
+        add("namespace", self.namespace if self.namespace else "")
+        for input_path in script_data.fingerprint_inputs:
+            add_file("input", os.path.join(self.config_module_dir, input_path))
+        return fingerprint.hexdigest()
+
+    def is_fingerprint_unchanged(self, script_data, fingerprint):
+        if os.environ.get("DAEDALUS_FORCE_RUN") == "1":
             return False
-        return script_data["isInstallScript"]
+        return self.config_fs.get(self.get_fingerprint_key(script_data)) == fingerprint
+
+    # only the keys of this module's own scripts, another module may share the name as prefix (web and web-api)
+    def clear_fingerprints(self):
+        for key in set(self.get_fingerprint_key(script_data) for script_data in self.descriptor.scripts.values()):
+            self.config_fs.delete(key)
+
+    def plan_entry(self, script, action, message=None):
+        return {
+            "module": self.name,
+            "namespace": self.namespace,
+            "script": script,
+            "action": action,
+            "message": message
+        }
+
+    # same dispatch as run() without side effects: the scripts that would be spawned, with their resolved params
+    def plan(self, script, internal=False, params=None, force=False):
+        script_data = self.search_script_by_alias(script)
+        if script_data is None:
+            if script == "reinstall":
+                if force or self.is_outdated():
+                    return self.plan("purge") + self.plan("install")
+                return [self.plan_entry(script, "skip", "installed version is the latest one")]
+            elif script == "update":
+                if not internal:
+                    return self.plan("reinstall", internal=True)
+                return []
+            elif script == "purge":
+                if not internal:
+                    entries = [self.plan_entry(script, "purge", "delete the installed version and " +
+                                               self.state_module_dir)]
+                    return entries + self.plan("purge", internal=True)
+                return []
+            elif script in ["sync-stop", "force-stop"]:
+                return self.plan("stop")
+            elif script in ["startup", "shutdown"]:
+                return []
+            elif script == "restart":
+                return self.plan("sync-stop") + self.plan("start")
+            elif script == "force-restart":
+                return self.plan("force-stop") + self.plan("start")
+            elif script in Module.command_ignore_on_fail:
+                return [self.plan_entry(script, "skip", "command is not defined for this module")]
+            return [self.plan_entry(script, "error", "no script with alias \"" + script + "\"")]
+
+        entries = []
+        if script == "update":
+            entries += self.plan("reinstall", internal=True)
+
+        entry = self.plan_entry(script, "run")
+        file_name = script_data.file
+        entry["file"] = file_name
+        entry["path"] = self.get_script_path(str(file_name))
+        entry["priority"] = script_data.priority
+        entry["params"] = []
+        entry["args"] = params if params else []
+        errors = list(script_data.errors)
+
+        installed_version_key = self.name + "-version"
+        if self.namespace:
+            installed_version_key += "#" + self.namespace
+        if script_data.is_install_script:
+            installed_version = self.config_fs.get(installed_version_key)
+            if installed_version is not None:
+                return entries + [self.plan_entry(script, "skip", "already installed (version " +
+                                                  installed_version + ")")]
+        elif self.namespace and self.namespace not in self.available_namespaces:
+            errors.append("namespace \"" + self.namespace + "\" is not installed")
+
+        param_values = []
+        for param, default_value in self.resolve_params(script_data.params):
+            param_value = self.config_fs.get(param)
+            source = "configfs"
+            if param_value is None and default_value is None:
+                source = "missing"
+                errors.append("requires configfs parameter \"" + param + "\"")
+            elif param_value is None:
+                param_value = default_value
+                source = "default"
+            entry["params"].append({"key": param, "value": param_value, "source": source})
+            param_values.append((param, param_value))
+        dependencies = script_data.dependencies
+        if dependencies is not None and not self.check_dependencies(dependencies):
+            errors.append("depends on: " + str(dependencies))
+
+        if errors:
+            entry["action"] = "error"
+            entry["message"] = "; ".join(errors)
+        elif script_data.is_fingerprinted and not script_data.is_install_script:
+            if self.is_fingerprint_unchanged(script_data, self.get_fingerprint(script_data, param_values, params)):
+                entry["action"] = "skip"
+                entry["message"] = "fingerprint unchanged"
+        return entries + [entry]
 
     @classmethod
     def run_error(cls):
@@ -307,7 +487,7 @@ class Module:
                          "defined for this module! Going to ignore!")
                 return 0
             else:
-                self.log("Error: <" + self.name + namespace_str + "> does not contain " +
+                self.log("Error: <" + self.get_full_name() + "> does not contain " +
                          "any script with alias \"" + script + "\"")
                 self.run_error()
 
@@ -316,23 +496,14 @@ class Module:
             if rc != 0:
                 return rc
 
-        file_name = None
-        if "file" in script_data:
-            file_name = script_data["file"]
-
-        params = None
-        if "params" in script_data:
-            params = script_data["params"]
-            if not isinstance(params, list):
-                params = [params]
-
-        dependencies = None
-        if "dependencies" in script_data:
-            dependencies = script_data["dependencies"]
-
-        is_install_script = False
-        if "isInstallScript" in script_data:
-            is_install_script = script_data["isInstallScript"]
+        file_name = script_data.file
+        params = script_data.params
+        dependencies = script_data.dependencies
+        is_install_script = script_data.is_install_script
+        if script_data.errors:
+            self.log("Error: command \"" + script + "\" (" + str(file_name) + ") has an invalid description: " +
+                     "; ".join(script_data.errors))
+            self.run_error()
 
         installed_version_key = self.name + "-version"
         if self.namespace:
@@ -371,63 +542,41 @@ class Module:
                          self.namespace + "\" installed!")
                 exit(2)
 
-        param_values = ""
-        if params is not None:
-            for param in params:
-                default_value = None
-                if ":" in param:
-                    tokens = param.split(":")
-                    param = tokens[0]
-                    default_value = tokens[1]
-                    for index in range(2, len(tokens)):
-                        default_value += ":"
-                        default_value += tokens[index]
-                is_global = False
-                use_namespace = True
-                if ">" in param:
-                    tokens = param.split(">")
-                    param = tokens[1]
-                    selector = tokens[0].upper()
-                    if "G" in selector:
-                        is_global = True
-                    elif "L" in selector:
-                        is_global = False
-                    if "M" in selector:
-                        use_namespace = True
-                    if "S" in selector:
-                        use_namespace = False
-                if not is_global and self.config_plugin_name is not None:
-                    param = self.config_plugin_name + "." + param
-                if use_namespace and self.namespace is not None:
-                    if self.config_fs.exists(param + "#" + self.namespace):
-                        param += "#" + self.namespace
-                param_value = self.config_fs.get(param)
-                if param_value is None and default_value is None:
-                    self.log("Error: command \"" + script + "\" (" + file_name + 
-                             ") requires configfs parameter \"" + param + "\"")
-                    self.run_error()
-                elif param_value is None and default_value is not None:
-                    param_value = default_value
-                    self.log("Warning: command \"" + script + "\" (" + file_name + 
-                             ") requires configfs parameter \"" +
-                             param + "\". Setting it to default value: " + default_value)
-                    self.config_fs.set(param, default_value)
-                param_values += " "
-                param_values += escape_arg(param_value)
+        resolved_param_values = []
+        for param, default_value in self.resolve_params(params):
+            param_value = self.config_fs.get(param)
+            if param_value is None and default_value is None:
+                self.log("Error: command \"" + script + "\" (" + file_name + 
+                         ") requires configfs parameter \"" + param + "\"")
+                self.run_error()
+            elif param_value is None and default_value is not None:
+                param_value = default_value
+                self.log("Warning: command \"" + script + "\" (" + file_name + 
+                         ") requires configfs parameter \"" +
+                         param + "\". Setting it to default value: " + default_value)
+                self.config_fs.set(param, default_value)
+            resolved_param_values.append((param, param_value))
         if dependencies is not None:
             if not self.check_dependencies(dependencies):
                 self.log("Error: command \"" + script + "\" (" + file_name + 
                          ") depends on: " + str(dependencies))
                 self.run_error()
 
-        command = "sudo -E " + self.root_dir + "/tools/bash/run_from_path.sh " + self.env["DAEDALUS_PROJECT_PATH"] + " "
-        command += self.config_module_dir + "/scripts/" + file_name
-        command += param_values
-        params = script_params
-        if params is not None:
-            for param in params:
-                command += " "
-                command += escape_arg(param)
+        fingerprint = None
+        if script_data.is_fingerprinted and not is_install_script:
+            fingerprint = self.get_fingerprint(script_data, resolved_param_values, script_params)
+            if self.is_fingerprint_unchanged(script_data, fingerprint):
+                self.log("Command \"" + script + "\" skipped, its inputs did not change since the last " +
+                         "successful run (use --force to run it anyway)")
+                return 0
+
+        args = [param_value for _, param_value in resolved_param_values]
+        if script_params is not None:
+            args += script_params
+        shell = is_shell_exec_mode(self.config_fs.get("option-exec-mode"))
+        command = get_script_command(self.root_dir, self.env["DAEDALUS_PROJECT_PATH"],
+                                     self.get_script_path(file_name), args, shell=shell)
+        cwd = None if shell else self.env["DAEDALUS_PROJECT_PATH"]
 
         env = self.env
         env["DAEDALUS_MODULE_COMMAND"] = script
@@ -439,7 +588,29 @@ class Module:
         env["DAEDALUS_MODULE_NAMESPACE"] = namespace
         env["DAEDALUS_FULL_STATE_MODULE_PATH"] = self.state_module_dir + namespace_suffix
         env["DAEDALUS_FULL_MODULE_NAME"] = self.name + namespace_suffix
-        rc = run(command, env=env)
+        output = self.get_output_options(script, file_name)
+        start_time = time.time()
+        if script_data.timeout is not None:
+            result = run_in_process_group(command, env=env, timeout=script_data.timeout,
+                                          kill_after=script_data.kill_after, shell=shell, cwd=cwd, **output)
+            rc = result.rc
+            if result.timed_out:
+                self.log("Error: command \"" + script + "\" timed out after " + "{:g}".format(script_data.timeout) +
+                         "s, its processes were " + ("killed" if result.killed else "terminated") +
+                         " (rc " + str(rc) + ", " + "{:.1f}".format(result.duration) + "s)")
+                self.journal("script", script, start_time, rc, file=file_name, timedOut=True)
+                if fingerprint is not None:
+                    self.config_fs.delete(self.get_fingerprint_key(script_data))
+                return rc
+        else:
+            rc = run(command, env=env, shell=shell, cwd=cwd, **output)
+        self.journal("script", script, start_time, rc, file=file_name)
+
+        if fingerprint is not None:
+            if rc == 0:
+                self.config_fs.set(self.get_fingerprint_key(script_data), fingerprint)
+            else:
+                self.config_fs.delete(self.get_fingerprint_key(script_data))
 
         if is_install_script:
             self.config_fs.set(installed_version_key, self.desc["version"])
@@ -0,0 +1,108 @@
+DEFAULT_KILL_AFTER = 10
+
+
+def str_to_priority(priority):
+    if type(priority) is int:
+        return priority
+    priority = priority.upper()
+    if priority == "FIRST":
+        return -500
+    elif priority == "LAST":
+        return 500
+    return 0
+
+
+# "[selector>]key[:default]" script param. The selector letters are G (global key) or L (key of the config plugin,
+# the default) and M (use the "key#namespace" variant when it exists, the default) or S (always the shared key)
+class ParamSpec:
+    __slots__ = ("key", "default", "is_global", "use_namespace")
+
+    def __init__(self, param, config_plugin_name=None):
+        self.default = None
+        if ":" in param:
+            param, self.default = param.split(":", 1)
+        self.is_global = False
+        self.use_namespace = True
+        if ">" in param:
+            tokens = param.split(">")
+            param = tokens[1]
+            selector = tokens[0].upper()
+            if "G" in selector:
+                self.is_global = True
+            elif "L" in selector:
+                self.is_global = False
+            if "M" in selector:
+                self.use_namespace = True
+            if "S" in selector:
+                self.use_namespace = False
+        if not self.is_global and config_plugin_name is not None:
+            param = config_plugin_name + "." + param
+        self.key = param
+
+
+# seconds given as a number or a numeric string ("30", "2.5"); raises ValueError for anything else or when the
+# value is below the minimum (or equal to it when the minimum is exclusive)
+def parse_seconds(value, minimum=0, exclusive=True):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError
+    seconds = float(value)
+    if seconds != seconds or seconds < minimum or (exclusive and seconds == minimum):
+        raise ValueError
+    return seconds
+
+
+class ScriptDescriptor:
+    __slots__ = ("file", "priority", "params", "dependencies", "is_install_script", "is_recursive",
+                 "is_fingerprinted", "fingerprint_inputs", "timeout", "kill_after", "errors")
+
+    def __init__(self, script_data, config_plugin_name=None):
+        self.file = script_data.get("file")
+        self.priority = str_to_priority(script_data.get("priority", 0))
+        params = script_data.get("params")
+        if params is not None and not isinstance(params, list):
+            params = [params]
+        self.params = None
+        if params is not None:
+            self.params = tuple(ParamSpec(param, config_plugin_name) for param in params)
+        self.dependencies = script_data.get("dependencies")
+        self.is_install_script = script_data.get("isInstallScript", False)
+        self.is_recursive = script_data.get("isRecursive", False)
+        self.is_fingerprinted = script_data.get("isFingerprinted", False)
+        self.fingerprint_inputs = tuple(script_data.get("fingerprintInputs", []))
+        # seconds before the script's process group gets SIGTERM, then SIGKILL after "killAfter" more seconds.
+        # Bad values are kept in errors and reported when the script is planned or run
+        self.errors = []
+        self.timeout = None
+        self.kill_after = float(DEFAULT_KILL_AFTER)
+        if script_data.get("timeout") is not None:
+            try:
+                self.timeout = parse_seconds(script_data["timeout"])
+            except ValueError:
+                self.errors.append("\"timeout\" must be a positive number of seconds, got " +
+                                   repr(script_data["timeout"]))
+        if script_data.get("killAfter") is not None:
+            try:
+                self.kill_after = parse_seconds(script_data["killAfter"], exclusive=False)
+            except ValueError:
+                self.errors.append("\"killAfter\" must be zero or a positive number of seconds, got " +
+                                   repr(script_data["killAfter"]))
+
+
+# description.json compiled once per load: scripts are indexed by alias (the first script declaring an alias wins,
+# like the linear search it replaces) with their params, priority and flags already parsed
+class ModuleDescriptor:
+    __slots__ = ("scripts", "is_singleton", "max_parallel_namespaces")
+
+    def __init__(self, desc, config_plugin_name=None):
+        self.scripts = {}
+        for script_data in desc.get("scripts", []):
+            if "aliases" not in script_data:
+                continue
+            script = ScriptDescriptor(script_data, config_plugin_name)
+            for alias in script_data["aliases"]:
+                self.scripts.setdefault(alias, script)
+        self.is_singleton = desc.get("isSingleton", False)
+        self.max_parallel_namespaces = desc.get("maxParallelNamespaces")
+
+    def get_script(self, alias):
+        return self.scripts.get(alias)
@@ -0,0 +1,100 @@
+import os
+import json
+
+INDEX_VERSION = 1
+
+
+def get_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+# on-disk cache of the module list and of the parsed description files of a project, every entry is keyed by the
+# mtime and size of the paths it was built from, so only what changed since the last run is scanned again
+class ModuleIndex:
+    def __init__(self, path):
+        self.path = path
+        self.module_list = None
+        self.descriptions = {}
+        self.compiled_graph = None
+        self.changed = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as index_file:
+                data = json.load(index_file)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != INDEX_VERSION:
+            return
+        self.module_list = data.get("moduleList")
+        self.descriptions = data.get("descriptions", {})
+        self.compiled_graph = data.get("compiledGraph")
+
+    def save(self):
+        if not self.changed:
+            return
+        data = {
+            "version": INDEX_VERSION,
+            "moduleList": self.module_list,
+            "descriptions": self.descriptions,
+            "compiledGraph": self.compiled_graph
+        }
+        temp_path = self.path + "." + str(os.getpid()) + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temp_path, "w") as index_file:
+                json.dump(data, index_file)
+            os.replace(temp_path, self.path)
+        except OSError:
+            # a read-only state dir only costs the full scan on the next run
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self.changed = False
+
+    def get_module_list(self):
+        if self.module_list is None:
+            return None
+        for path, stamp in self.module_list["stamps"].items():
+            if get_stamp(path) != stamp:
+                return None
+        return self.module_list["modules"], self.module_list["configPlugins"]
+
+    # stamps are taken before the paths are read, so a change made during the scan is picked up on the next run
+    def set_module_list(self, modules, config_plugins, stamps):
+        self.module_list = {
+            "modules": modules,
+            "configPlugins": config_plugins,
+            "stamps": stamps
+        }
+        self.compiled_graph = None
+        self.changed = True
+
+    def get_description(self, path, stamp):
+        entry = self.descriptions.get(path)
+        if entry is None or stamp is None or entry["stamp"] != stamp:
+            return None
+        return entry["description"]
+
+    def set_description(self, path, description, stamp):
+        if stamp is None or description is None:
+            self.descriptions.pop(path, None)
+        else:
+            self.descriptions[path] = {"stamp": stamp, "description": description}
+        self.compiled_graph = None
+        self.changed = True
+
+    def set_compiled_graph(self, compiled_graph):
+        self.compiled_graph = compiled_graph
+        self.changed = True
+
+    def prune(self, paths):
+        for path in list(self.descriptions):
+            if path not in paths:
+                del self.descriptions[path]
+                self.changed = True
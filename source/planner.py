@@ -0,0 +1,89 @@
+import json
+
+
+# dry run of bulk and module commands: builds the same schedules the engine would run and asks every module what
+# it would spawn, no script is executed and nothing is written to ConfigFS
+class Planner:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def plan_task(self, task):
+        module = self.engine.module(task.data["module"]).for_namespace(task.data["namespace"])
+        runs = module.plan(task.data["command"], params=task.data["params"])
+        return {
+            "task": task.name,
+            "module": module.get_name(),
+            "namespace": module.namespace,
+            "command": task.data["command"],
+            "dependencies": sorted(task.dependencies),
+            "runs": runs
+        }
+
+    def plan_scheduler(self, step, scheduler):
+        buckets = []
+        for barrier, waves in scheduler.get_waves():
+            buckets.append({
+                "priority": barrier,
+                "waves": [[self.plan_task(task) for task in wave] for wave in waves]
+            })
+        return {"command": step, "buckets": buckets}
+
+    def plan_bulk(self, command, selection=None):
+        steps = [self.plan_scheduler(step, scheduler)
+                 for step, scheduler in self.engine.get_bulk_schedulers(command, selection)]
+        return self.get_plan(command, steps)
+
+    def plan_module_exec(self, names, command, params=None):
+        scheduler = self.engine.get_module_exec_scheduler(names, command, params=params)
+        return self.get_plan(command + " " + " ".join(names), [self.plan_scheduler(command, scheduler)])
+
+    def get_plan(self, command, steps):
+        errors = []
+        for step in steps:
+            for bucket in step["buckets"]:
+                for wave in bucket["waves"]:
+                    for task in wave:
+                        errors += [run for run in task["runs"] if run["action"] == "error"]
+        return {
+            "command": command,
+            "jobs": self.engine.get_jobs(),
+            "steps": steps,
+            "errors": errors
+        }
+
+    @staticmethod
+    def format_run(run):
+        name = "<" + run["module"] + ("#" + run["namespace"] if run["namespace"] else "") + "> " + run["script"]
+        if run["action"] == "run":
+            line = name + " -> " + run["path"]
+            for param in run["params"]:
+                line += " " + param["key"] + "=" + json.dumps(param["value"])
+                if param["source"] != "configfs":
+                    line += " (" + param["source"] + ")"
+            for arg in run["args"]:
+                line += " " + json.dumps(arg)
+            return line
+        elif run["action"] == "error":
+            return name + ": ERROR " + run["message"]
+        return name + ": " + run["action"] + " (" + run["message"] + ")"
+
+    @classmethod
+    def print_plan(cls, plan, output_format="text"):
+        if output_format == "json":
+            print(json.dumps(plan, indent=4))
+            return
+        print("Plan: " + plan["command"] + " (jobs: " + str(plan["jobs"]) + ")")
+        for step in plan["steps"]:
+            print("  Step: " + step["command"])
+            for bucket in step["buckets"]:
+                if bucket["priority"] is not None:
+                    print("    Priority " + str(bucket["priority"]) + ":")
+                for index, wave in enumerate(bucket["waves"]):
+                    print("      Group " + str(index + 1) + ": " + ", ".join(task["task"] for task in wave))
+                    for task in wave:
+                        for run in task["runs"]:
+                            print("        " + cls.format_run(run))
+        if plan["errors"]:
+            print("Plan: " + str(len(plan["errors"])) + " error(s)")
+        else:
+            print("Plan: OK")
@@ -0,0 +1,139 @@
+import importlib
+
+from profiler import Profiler
+
+ENTRY_POINT_GROUP = "daedalus.plugins"
+
+
+class Plugin:
+    def __init__(self, name, module_name, aliases=None, description=None, entry="parse_command"):
+        self.name = name
+        self.module_name = module_name
+        self.aliases = aliases if aliases else []
+        self.description = description
+        self.entry = entry
+        self.entry_point = None
+
+    def get_commands(self):
+        return [self.name] + self.aliases
+
+    def get_help_name(self):
+        if not self.aliases:
+            return self.name
+        return "{" + ", ".join(self.get_commands()) + "}"
+
+    def load_module(self):
+        with Profiler.phase("plugin import: " + self.name):
+            return importlib.import_module(self.module_name)
+
+    def load(self):
+        if self.entry_point is not None:
+            with Profiler.phase("plugin import: " + self.name):
+                return self.entry_point.load()
+        return getattr(self.load_module(), self.entry)
+
+    def parse_command(self, args):
+        return self.load()(args)
+
+
+# maps command names (and aliases) to plugin modules; modules are imported only when a command is dispatched
+class PluginRegistry:
+    plugins = []
+    commands = {}
+    entry_points_loaded = False
+
+    @classmethod
+    def register(cls, name, module_name, aliases=None, description=None, entry="parse_command"):
+        plugin = Plugin(name, module_name, aliases=aliases, description=description, entry=entry)
+        cls.add(plugin)
+        return plugin
+
+    @classmethod
+    def add(cls, plugin):
+        for command in plugin.get_commands():
+            if command in cls.commands:
+                print("Warning: plugin command \"" + command + "\" is already registered! Skipping ...")
+                return
+        cls.plugins.append(plugin)
+        for command in plugin.get_commands():
+            cls.commands[command] = plugin
+
+    @classmethod
+    def get(cls, command, external=True):
+        if command in cls.commands:
+            return cls.commands[command]
+        if not external:
+            return None
+        # third-party plugins are only looked up when the command is not a built-in one
+        cls.load_entry_points()
+        return cls.commands.get(command)
+
+    @classmethod
+    def load_module(cls, command):
+        plugin = cls.get(command)
+        if plugin is None:
+            return None
+        return plugin.load_module()
+
+    @classmethod
+    def get_plugins(cls):
+        cls.load_entry_points()
+        return cls.plugins
+
+    @classmethod
+    def iter_entry_points(cls):
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            try:
+                import pkg_resources
+            except ImportError:
+                return []
+            return list(pkg_resources.iter_entry_points(ENTRY_POINT_GROUP))
+        all_entry_points = entry_points()
+        if hasattr(all_entry_points, "select"):
+            return list(all_entry_points.select(group=ENTRY_POINT_GROUP))
+        return list(all_entry_points.get(ENTRY_POINT_GROUP, []))
+
+    @classmethod
+    def load_entry_points(cls):
+        if cls.entry_points_loaded:
+            return
+        cls.entry_points_loaded = True
+        for entry_point in cls.iter_entry_points():
+            if entry_point.name in cls.commands:
+                continue
+            module_name = getattr(entry_point, "module_name", None)
+            if module_name is None:
+                module_name = entry_point.value.split(":")[0]
+            plugin = Plugin(entry_point.name, module_name, description="third-party plugin")
+            plugin.entry_point = entry_point
+            cls.add(plugin)
+
+
+PluginRegistry.register("hosts", "plugins.hosts",
+                        description="easy way to edit and apply changes to /etc/hosts file")
+PluginRegistry.register("autossh", "plugins.autossh",
+                        description="manager for autossh connections")
+PluginRegistry.register("https", "plugins.https",
+                        description="wrapper over letsencrypt SSL certificate creation and renewal")
+PluginRegistry.register("ssh", "plugins.ssh",
+                        description="wrapper over ssh")
+PluginRegistry.register("nginx", "plugins.nginx",
+                        description="manager for nginx configuration. Implements nginx-modules")
+PluginRegistry.register("sshconfig", "plugins.sshconfig", aliases=["sshconf"],
+                        description="easy way to edit and apply changes to ssh config files")
+PluginRegistry.register("apply", "plugins.apply",
+                        description="collection for various system-wide parameter tweaking setup")
+PluginRegistry.register("template", "plugins.template", aliases=["jinja2"],
+                        description="easy environment for jinja2 template files rendering")
+PluginRegistry.register("apt", "plugins.apt",
+                        description="wrapper over apt")
+PluginRegistry.register("config-manager", "plugins.config_manager",
+                        aliases=["conf-manager", "conf-man", "config-man"],
+                        description="manager for configuration plugins")
+PluginRegistry.register("deployer", "plugins.deployer",
+                        description="deploy machines and clusters from JSON description files")
+PluginRegistry.register("shell", "plugins.shell",
+                        description="wrapper for default shell")
+PluginRegistry.register("project", "config", entry="project_parse_command")
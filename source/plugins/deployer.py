@@ -2,6 +2,7 @@ import sys
 import os
 import stat
 import copy
+import shlex
 
 parent_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 sys.path.insert(1, parent_dir)
@@ -10,6 +11,9 @@ import config
 from util import print_help_line, get_real_path, escape_arg, ensure_json_exists, load_json, save_json, dict_merge
 from json_include import JSONInclude
 
+# characters bash expands or interprets in a command line, shlex would take them literally
+BATCH_UNSAFE_CHARS = set("$`;&|<>()*?[]{}~#!")
+
 
 def print_help():
     print_help_line(0, "Daedalus \"deployer\" plugin help:")
@@ -22,6 +26,9 @@ def print_help():
     print_help_line(1, "add-context <path>", "adds the path to the current set of context files")
     print_help_line(1, "remove-context <path>", "remove the path from the current set of context files")
     print_help_line(1, "compile <file> [output]", "compile an json machine description file into a shell script")
+    print_help_line(1, "compile-batch <file> <output>", "same as compile, but the script runs the daedalus " +
+                    "commands through \"daedalus batch\" (one process and one session). Lines using shell " +
+                    "expansions ($VAR, globs, pipes, ...) still run through bash, and scripts see no input")
 
 
 def parse_command(args):
@@ -79,6 +86,10 @@ def parse_command(args):
             valid_command = True
             Deployer.load_context()
             Deployer.compile(args[2], args[3])
+        elif args[1] == "compile-batch":
+            valid_command = True
+            Deployer.load_context()
+            Deployer.compile(args[2], args[3], batch=True)
     return valid_command
 
 
@@ -176,6 +187,47 @@ class Deployer:
     def compile_header(cls, json_include, run_on=None):
         return "#!/usr/bin/env bash\n\n"
 
+    # batch lines are split like shlex does, without any of the expansions bash would make: a line using them
+    # keeps running through bash
+    @staticmethod
+    def is_batch_line(line):
+        if any(c in BATCH_UNSAFE_CHARS for c in line):
+            return False
+        try:
+            tokens = shlex.split(line)
+        except ValueError:
+            return False
+        return len(tokens) > 1 and tokens[0] == "daedalus"
+
+    @staticmethod
+    def compile_batch_block(lines, last=False):
+        if not lines:
+            return ""
+        if last:
+            block = "exec daedalus batch - <<'DAEDALUS_BATCH'\n"
+        else:
+            block = "daedalus batch - <<'DAEDALUS_BATCH' || exit $?\n"
+        return block + "\n".join(lines) + "\nDAEDALUS_BATCH\n"
+
+    # consecutive daedalus commands become one batch, a failing batch stops the script like a failing line of a
+    # single batch would
+    @classmethod
+    def to_batch_script(cls, script):
+        header = cls.compile_header(None)
+        if script.startswith(header):
+            script = script[len(header):]
+        batch_script = header
+        batch_lines = []
+        for line in script.splitlines():
+            if cls.is_batch_line(line) or (batch_lines and line.strip() == ""):
+                batch_lines.append(line)
+                continue
+            batch_script += cls.compile_batch_block(batch_lines)
+            batch_lines = []
+            batch_script += line + "\n"
+        batch_script += cls.compile_batch_block(batch_lines, last=True)
+        return batch_script
+
     @classmethod
     def compile_init(cls, json_include, run_on=None, priority=None):
         script = ""
@@ -661,10 +713,18 @@ class Deployer:
         return json_include
 
     @classmethod
-    def compile(cls, path, save_path=None):
+    def compile(cls, path, save_path=None, batch=False):
         work_dir = os.path.dirname(path)
         if not work_dir.startswith("/"):
             work_dir = None
+        if batch:
+            script = cls.compile(path, batch=False)
+            if script is None:
+                return None
+            script = cls.to_batch_script(script)
+            if save_path is not None:
+                cls.write_script(save_path, script)
+            return script
         json_include = cls.load_description(path, work_dir=work_dir)
         if json_include.data["type"] == "machine":
             run_on = None
@@ -0,0 +1,400 @@
+import os
+import sys
+import time
+import errno
+import codecs
+import signal
+import threading
+from time import localtime, strftime
+
+from profiler import Profiler
+
+DEFAULT_MAX_PROCESSES = 64
+TIMEOUT_RC = 124
+READ_SIZE = 65536
+# how often the output file of a running child is checked for new data to show on the console
+FOLLOW_INTERVAL = 0.05
+LOG_MAX_SIZE = 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+
+class ProcessResult:
+    def __init__(self, rc, duration, timed_out=False, killed=False):
+        self.rc = rc
+        self.duration = duration
+        self.timed_out = timed_out
+        self.killed = killed
+
+
+class ManagedProcess:
+    def __init__(self, process, new_group):
+        self.process = process
+        self.new_group = new_group
+
+    def is_running(self):
+        return self.process.returncode is None
+
+    def send_signal(self, sig):
+        try:
+            if self.new_group:
+                os.killpg(self.process.pid, sig)
+            elif self.is_running():
+                os.kill(self.process.pid, sig)
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            # part of the group runs as another user (sudo), at least signal the direct child
+            try:
+                if self.is_running():
+                    os.kill(self.process.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def is_alive(self):
+        if self.is_running():
+            return True
+        if not self.new_group:
+            return False
+        try:
+            os.killpg(self.process.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+
+# unterminated console line of a stream, another stream writing in the meantime ends it first
+class ConsoleLine:
+    def __init__(self, output, tag):
+        self.output = output
+        self.tag = tag
+        self.at_line_start = True
+
+
+# where the output of a child goes: inherited from Daedalus unless it is tagged on the console or captured to a log.
+# A captured child writes to "<log>.out" (or to a temporary file without a log), never to a pipe, so the services a
+# start script leaves running keep a valid stdout after Daedalus exits. While the child runs that file is copied to
+# the log with a timestamp per line and to the console; what a service writes once its script exited stays in
+# "<log>.out" only. The child sees a file instead of a terminal, so it may buffer its output and drop colors
+class Output:
+    def __init__(self, tag=None, log_path=None, log_header=None, console=True):
+        self.tag = tag
+        self.log_path = log_path
+        self.log_header = log_header
+        self.console = console
+        self.console_line = ConsoleLine(sys.stdout, tag if tag else "")
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.log_file = None
+        self.log_line = ""
+        self.write_fd = None
+        self.read_fd = None
+        self.offset = 0
+
+    def is_captured(self):
+        return self.tag is not None or self.log_path is not None or not self.console
+
+    def open(self):
+        if self.log_path is not None:
+            try:
+                self.log_file = open_log(self.log_path)
+                self.log_file.write(get_timestamp() + " start" +
+                                    (": " + self.log_header if self.log_header else "") + "\n")
+                self.write_fd = os.open(self.log_path + ".out", os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_TRUNC,
+                                        0o644)
+                self.read_fd = os.open(self.log_path + ".out", os.O_RDONLY)
+                return
+            except OSError as e:
+                print("Warning: could not open log file \"" + self.log_path + "\": " + str(e.strerror))
+                self.close_files()
+        import tempfile
+        temp_file = tempfile.TemporaryFile()
+        self.write_fd = os.dup(temp_file.fileno())
+        self.read_fd = os.dup(temp_file.fileno())
+        temp_file.close()
+
+    def close_files(self):
+        for fd in [self.write_fd, self.read_fd]:
+            if fd is not None:
+                os.close(fd)
+        self.write_fd = None
+        self.read_fd = None
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+    # the child no longer needs Daedalus' copy of its output fd once it is started
+    def release_write_fd(self):
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+            self.write_fd = None
+
+    def get_size(self):
+        return os.fstat(self.read_fd).st_size
+
+    # the text written since the last call (up to "end"), None when nothing was written
+    def read(self, end=None):
+        size = READ_SIZE if end is None else min(READ_SIZE, end - self.offset)
+        if size <= 0:
+            return None
+        data = os.pread(self.read_fd, size, self.offset)
+        if not data:
+            return None
+        self.offset += len(data)
+        return self.decoder.decode(data)
+
+    def write_log(self, text, final=False):
+        if self.log_file is None:
+            return
+        lines = (self.log_line + text).split("\n")
+        self.log_line = lines.pop()
+        if final and self.log_line:
+            lines.append(self.log_line)
+            self.log_line = ""
+        if lines:
+            timestamp = get_timestamp()
+            self.log_file.write("".join(timestamp + " " + line + "\n" for line in lines))
+
+    def close(self, result):
+        self.write_log(self.decoder.decode(b"", final=True), final=True)
+        if self.log_file is not None:
+            status = "timed out, " if result.timed_out else ""
+            self.log_file.write(get_timestamp() + " exit: " + status + "rc " + str(result.rc) + ", " +
+                                "{:.3f}".format(result.duration) + "s\n")
+        self.close_files()
+
+
+def get_timestamp():
+    return strftime("[%Y-%m-%d %H:%M:%S]", localtime())
+
+
+# "path" is appended to and moved to "path.1" (shifting the older ones) once it grows over LOG_MAX_SIZE
+def open_log(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        rotate = os.path.getsize(path) > LOG_MAX_SIZE
+    except OSError:
+        rotate = False
+    if rotate:
+        for index in range(LOG_BACKUP_COUNT - 1, 0, -1):
+            if os.path.exists(path + "." + str(index)):
+                os.replace(path + "." + str(index), path + "." + str(index + 1))
+        os.replace(path, path + ".1")
+    return open(path, "a", buffering=1, errors="replace")
+
+
+# the return codes a shell uses when it can not execute a command
+def get_spawn_error_rc(command, error):
+    if not isinstance(command, str):
+        command = command[0]
+    print("Error: could not execute \"" + command + "\": " + str(error.strerror))
+    return 127 if error.errno == errno.ENOENT else 126
+
+
+# every child process of Daedalus is started from one asyncio loop running in a background thread: at most
+# DAEDALUS_MAX_PROCESSES children run at the same time, their output can be captured to a log file and tagged line
+# by line on the console, and signals received by Daedalus are forwarded to all of them. submit()
+# returns a concurrent.futures.Future (asyncio.wrap_future() turns it into an awaitable), run() blocks until the
+# child exits. asyncio is only imported once a child is spawned, most commands never need it.
+class ProcessManager:
+    loop = None
+    thread = None
+    semaphore = None
+    lock = threading.Lock()
+    processes = set()
+    output_lock = threading.Lock()
+    open_line = None
+
+    @staticmethod
+    def get_max_processes():
+        try:
+            return max(1, int(os.environ.get("DAEDALUS_MAX_PROCESSES", DEFAULT_MAX_PROCESSES)))
+        except ValueError:
+            return DEFAULT_MAX_PROCESSES
+
+    @classmethod
+    def start(cls):
+        with cls.lock:
+            if cls.loop is None:
+                import asyncio
+                loop = asyncio.new_event_loop()
+                cls.thread = threading.Thread(target=loop.run_forever, name="process-manager", daemon=True)
+                cls.thread.start()
+                cls.loop = loop
+            return cls.loop
+
+    # a forked child (a daemon request) only gets the calling thread, the loop thread of the parent is gone
+    @classmethod
+    def reset_after_fork(cls):
+        cls.loop = None
+        cls.thread = None
+        cls.semaphore = None
+        cls.lock = threading.Lock()
+        cls.processes = set()
+        cls.output_lock = threading.Lock()
+        cls.open_line = None
+
+    @classmethod
+    def submit(cls, command, env=None, shell=True, cwd=None, tag=None, new_group=False, timeout=None,
+               kill_after=None, log_path=None, log_header=None, console=True):
+        import asyncio
+        loop = cls.start()
+        output = Output(tag, log_path, log_header, console)
+        return asyncio.run_coroutine_threadsafe(
+            cls.run_process(command, env, shell, cwd, output, new_group, timeout, kill_after), loop)
+
+    @classmethod
+    def run(cls, command, **kwargs):
+        return cls.submit(command, **kwargs).result()
+
+    @classmethod
+    def signal_all(cls, sig, groups_only=False):
+        with cls.lock:
+            processes = list(cls.processes)
+        for managed in processes:
+            if managed.new_group or not groups_only:
+                managed.send_signal(sig)
+
+    # children sharing the process group of Daedalus already get the SIGINT of the terminal, the ones running in a
+    # group of their own get it forwarded. Any other signal goes to every child before Daedalus exits
+    @classmethod
+    def handle_signal(cls, signum, frame):
+        if signum == signal.SIGINT:
+            cls.signal_all(signum, groups_only=True)
+            raise KeyboardInterrupt
+        cls.signal_all(signum)
+        raise SystemExit(128 + signum)
+
+    @classmethod
+    def install_signal_handlers(cls):
+        signal.signal(signal.SIGINT, cls.handle_signal)
+        signal.signal(signal.SIGTERM, cls.handle_signal)
+        signal.signal(signal.SIGHUP, cls.handle_signal)
+
+    @staticmethod
+    async def spawn(command, env, shell, cwd, stdout, stderr, new_group):
+        import asyncio
+        kwargs = {"env": env, "cwd": cwd, "stdout": stdout, "stderr": stderr}
+        if new_group:
+            if sys.version_info >= (3, 11):
+                kwargs["process_group"] = 0
+            else:
+                kwargs["preexec_fn"] = os.setpgrp
+        if cwd is not None:
+            env["PWD"] = cwd
+        if shell:
+            return await asyncio.create_subprocess_shell(command, **kwargs)
+        return await asyncio.create_subprocess_exec(*command, **kwargs)
+
+    @classmethod
+    def write_console(cls, line, text):
+        with cls.output_lock:
+            if cls.open_line is not None and cls.open_line is not line:
+                cls.open_line.output.write("\n")
+                cls.open_line.output.flush()
+                cls.open_line.at_line_start = True
+            content = ""
+            for part in text.splitlines(keepends=True):
+                if line.at_line_start:
+                    content += line.tag
+                content += part
+                line.at_line_start = part.endswith("\n")
+            line.output.write(content)
+            line.output.flush()
+            # partial lines (prompts) are shown right away instead of waiting for their end
+            cls.open_line = None if line.at_line_start else line
+
+    # copies what the child wrote since the last call to the log and the console, returns whether there was any
+    @classmethod
+    def forward(cls, output, end=None):
+        text = output.read(end)
+        if text is None:
+            return False
+        output.write_log(text)
+        if output.console and text:
+            cls.write_console(output.console_line, text)
+        return True
+
+    # follows the output file of the child while it runs, then forwards what is left up to the size the file had
+    # when it exited: a service it started may keep writing there forever. The file and console I/O runs on the
+    # executor of the loop, never on the loop thread itself
+    @classmethod
+    async def follow(cls, output, process):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        end = None
+        while True:
+            if end is None and process.returncode is not None:
+                end = await loop.run_in_executor(None, output.get_size)
+            if await loop.run_in_executor(None, cls.forward, output, end):
+                continue
+            if end is not None:
+                break
+            await asyncio.sleep(FOLLOW_INTERVAL)
+        if output.console and not output.console_line.at_line_start:
+            await loop.run_in_executor(None, cls.write_console, output.console_line, "\n")
+
+    # the direct child may exit on the signal while its own children keep running, so the whole group is waited for
+    # before the SIGKILL escalation. Returns whether the group had to be killed
+    @staticmethod
+    async def stop(managed, sig, kill_after=None):
+        import asyncio
+        managed.send_signal(sig)
+        deadline = None if kill_after is None else time.time() + kill_after
+        while managed.is_alive():
+            if deadline is not None and time.time() >= deadline:
+                managed.send_signal(signal.SIGKILL)
+                await managed.process.wait()
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+    @classmethod
+    async def run_process(cls, command, env, shell, cwd, output, new_group, timeout, kill_after):
+        import asyncio
+        if cls.semaphore is None:
+            cls.semaphore = asyncio.Semaphore(cls.get_max_processes())
+        async with cls.semaphore:
+            env = dict(os.environ if env is None else env)
+            loop = asyncio.get_running_loop()
+            captured = output.is_captured()
+            if captured:
+                await loop.run_in_executor(None, output.open)
+            start_time = time.time()
+            try:
+                process = await cls.spawn(command, env, shell, cwd, output.write_fd, output.write_fd, new_group)
+            except OSError as e:
+                result = ProcessResult(get_spawn_error_rc(command, e), time.time() - start_time)
+                await loop.run_in_executor(None, output.close, result)
+                return result
+            finally:
+                output.release_write_fd()
+            follower = None
+            if captured:
+                follower = asyncio.ensure_future(cls.follow(output, process))
+            managed = ManagedProcess(process, new_group)
+            with cls.lock:
+                cls.processes.add(managed)
+            timed_out = False
+            killed = False
+            try:
+                try:
+                    rc = await asyncio.wait_for(process.wait(), timeout)
+                except asyncio.TimeoutError:
+                    timed_out = True
+                    killed = await cls.stop(managed, signal.SIGTERM, kill_after)
+                    rc = TIMEOUT_RC
+                if follower is not None:
+                    await follower
+            finally:
+                with cls.lock:
+                    cls.processes.discard(managed)
+            duration = time.time() - start_time
+            Profiler.add_child_time(duration)
+            result = ProcessResult(rc, duration, timed_out=timed_out, killed=killed)
+            if captured:
+                await loop.run_in_executor(None, output.close, result)
+            return result
+
+
+os.register_at_fork(after_in_child=ProcessManager.reset_after_fork)
@@ -0,0 +1,95 @@
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+# per-phase wall time of a single Daedalus invocation, enabled by the global --profile flags
+class Profiler:
+    enabled = False
+    start_time = None
+    json_path = None
+    cprofile_path = None
+    cprofile = None
+    phases = []
+    depth = 0
+    child_count = 0
+    child_time = 0.0
+    child_lock = threading.Lock()
+
+    @classmethod
+    def enable(cls, json_path=None, cprofile_path=None):
+        if not cls.enabled:
+            cls.enabled = True
+            cls.start_time = time.time()
+        if json_path is not None:
+            cls.json_path = json_path
+        if cprofile_path is not None and cls.cprofile is None:
+            import cProfile
+            cls.cprofile_path = cprofile_path
+            cls.cprofile = cProfile.Profile()
+            cls.cprofile.enable()
+
+    @classmethod
+    @contextmanager
+    def phase(cls, name):
+        if not cls.enabled:
+            yield
+            return
+        entry = {"name": name, "depth": cls.depth, "duration": None}
+        cls.phases.append(entry)
+        cls.depth += 1
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            entry["duration"] = time.time() - start_time
+            cls.depth -= 1
+
+    @classmethod
+    def add_child_time(cls, duration):
+        if cls.enabled:
+            # bulk commands run module scripts from several threads
+            with cls.child_lock:
+                cls.child_count += 1
+                cls.child_time += duration
+
+    @classmethod
+    def get_report(cls):
+        return {
+            "total": time.time() - cls.start_time,
+            "phases": cls.phases,
+            "childProcesses": {
+                "count": cls.child_count,
+                "duration": cls.child_time
+            }
+        }
+
+    @staticmethod
+    def format_ms(duration):
+        if duration is None:
+            return "unfinished"
+        return "{0:.2f} ms".format(duration * 1000)
+
+    @classmethod
+    def report(cls):
+        if not cls.enabled:
+            return
+        if cls.cprofile is not None:
+            cls.cprofile.disable()
+            cls.cprofile.dump_stats(cls.cprofile_path)
+        data = cls.get_report()
+        print("Profile:")
+        for entry in data["phases"]:
+            name = "  " * (entry["depth"] + 1) + entry["name"]
+            print(name.ljust(50) + cls.format_ms(entry["duration"]))
+        print(("  child processes (" + str(cls.child_count) + ")").ljust(50) + cls.format_ms(cls.child_time))
+        print("  total".ljust(50) + cls.format_ms(data["total"]))
+        if cls.cprofile is not None:
+            print("Profile: cProfile stats saved to " + cls.cprofile_path)
+        if cls.json_path is not None:
+            with open(cls.json_path, "w") as json_file:
+                json.dump(data, json_file, indent=4)
+            print("Profile: JSON timings saved to " + cls.json_path)
+        sys.stdout.flush()
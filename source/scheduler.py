@@ -0,0 +1,172 @@
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Task:
+    def __init__(self, name, func, dependencies=None, barrier=0, index=0, data=None, group=None):
+        self.name = name
+        self.func = func
+        self.data = data
+        self.group = group
+        self.dependencies = set(dependencies) if dependencies else set()
+        self.barrier = barrier
+        self.index = index
+        self.rc = None
+        self.duration = None
+        self.skipped = False
+
+
+class SchedulerResult:
+    def __init__(self, tasks, duration):
+        self.tasks = tasks
+        self.duration = duration
+
+    def get_failed(self):
+        return [task.name for task in self.tasks if not task.skipped and task.rc != 0]
+
+    def get_skipped(self):
+        return [task.name for task in self.tasks if task.skipped]
+
+    def get_rc(self):
+        for task in self.tasks:
+            if not task.skipped and task.rc != 0:
+                return task.rc
+        return 0
+
+
+# runs tasks on a pool of worker threads while honouring their dependencies. Tasks are added in the order a serial
+# run would use and are split in barrier groups: a group starts only after the previous one finished, dependencies
+# on tasks outside of the current group are ignored. Among the ready tasks the one added first is started first,
+# so with one worker the order is exactly the serial one. Without keep_going every task depending on a failed one,
+# in its own group or in a later one, is skipped. Tasks sharing a limited "group" (the namespaces of a module) take
+# at most that many of the workers at the same time.
+class Scheduler:
+    def __init__(self, jobs=1, keep_going=True):
+        self.jobs = max(1, jobs)
+        self.keep_going = keep_going
+        self.tasks = []
+        self.task_by_name = {}
+        self.limits = {}
+
+    def add_task(self, name, func, dependencies=None, barrier=0, data=None, group=None):
+        task = Task(name, func, dependencies=dependencies, barrier=barrier, index=len(self.tasks), data=data,
+                    group=group)
+        self.tasks.append(task)
+        self.task_by_name[name] = task
+        return task
+
+    def set_limit(self, group, limit):
+        self.limits[group] = max(1, limit)
+
+    def is_limited(self, task, running_tasks):
+        if task.group not in self.limits:
+            return False
+        return len([other for other in running_tasks if other.group == task.group]) >= self.limits[task.group]
+
+    def get_barrier_groups(self):
+        groups = []
+        group_by_barrier = {}
+        for task in self.tasks:
+            if task.barrier not in group_by_barrier:
+                group_by_barrier[task.barrier] = []
+                groups.append(group_by_barrier[task.barrier])
+            group_by_barrier[task.barrier].append(task)
+        return groups
+
+    # tasks of each barrier group split in waves: a wave only depends on the waves before it, so its tasks may run
+    # at the same time
+    def get_waves(self):
+        barrier_waves = []
+        for group in self.get_barrier_groups():
+            names = set(task.name for task in group)
+            level = {}
+            waves = []
+            remaining = list(group)
+            while remaining:
+                wave = [task for task in remaining
+                        if all(level.get(name) is not None for name in task.dependencies if name in names)]
+                if not wave:
+                    # unsatisfiable dependencies, run() would never start these either
+                    break
+                for task in wave:
+                    level[task.name] = len(waves)
+                waves.append(wave)
+                remaining = [task for task in remaining if task.name not in level]
+            barrier_waves.append((group[0].barrier, waves))
+        return barrier_waves
+
+    @staticmethod
+    def run_task(task):
+        start_time = time.time()
+        try:
+            rc = task.func()
+            task.rc = rc if isinstance(rc, int) else 0
+        except SystemExit as e:
+            task.rc = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            task.rc = 1
+        task.duration = time.time() - start_time
+        return task
+
+    # a task of an earlier group that failed or was skipped, tasks of later groups have not run yet
+    def is_failed(self, name):
+        task = self.task_by_name.get(name)
+        return task is not None and (task.skipped or (task.rc is not None and task.rc != 0))
+
+    def run_group(self, executor, group):
+        names = set(task.name for task in group)
+        waiting_for = {}
+        dependents = {}
+        for task in group:
+            waiting_for[task.name] = set(name for name in task.dependencies if name in names)
+            for name in waiting_for[task.name]:
+                dependents.setdefault(name, []).append(task)
+        if not self.keep_going:
+            for task in group:
+                if any(self.is_failed(name) for name in task.dependencies if name not in names):
+                    self.skip(task, dependents)
+        ready = [task for task in group if not waiting_for[task.name] and not task.skipped]
+        running = {}
+        try:
+            while ready or running:
+                ready.sort(key=lambda task: task.index)
+                for task in list(ready):
+                    if len(running) >= self.jobs:
+                        break
+                    if self.is_limited(task, running.values()):
+                        continue
+                    ready.remove(task)
+                    running[executor.submit(self.run_task, task)] = task
+                done, _ = wait(list(running), timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    failed = task.rc != 0
+                    for dependent in dependents.get(task.name, []):
+                        if failed and not self.keep_going:
+                            self.skip(dependent, dependents)
+                            continue
+                        waiting_for[dependent.name].discard(task.name)
+                        if not waiting_for[dependent.name] and not dependent.skipped:
+                            ready.append(dependent)
+        except KeyboardInterrupt:
+            for future in running:
+                future.cancel()
+            raise
+
+    def skip(self, task, dependents):
+        if task.skipped:
+            return
+        task.skipped = True
+        for dependent in dependents.get(task.name, []):
+            self.skip(dependent, dependents)
+
+    def run(self):
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for group in self.get_barrier_groups():
+                self.run_group(executor, group)
+        sys.stdout.flush()
+        return SchedulerResult(self.tasks, time.time() - start_time)
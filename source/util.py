@@ -1,12 +1,52 @@
-import subprocess
 import json
 import os
 import getpass
 import sys
 import string
 import random
+import shlex
 import collections
 
+from process_manager import ProcessManager
+
+# written at install time and read directly by the launcher, so it does not need to source the shell profiles
+DAEDALUS_ENV_FILE = os.environ.get("DAEDALUS_ENV_FILE", "/etc/daedalus/env")
+
+
+def load_env_file(path=DAEDALUS_ENV_FILE):
+    env = {}
+    try:
+        with open(path) as env_file:
+            lines = env_file.readlines()
+    except OSError:
+        return env
+    for line in lines:
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        tokens = shlex.split(line)
+        if tokens and tokens[0] == "export":
+            tokens.pop(0)
+        for token in tokens:
+            if "=" in token:
+                key, value = token.split("=", 1)
+                env[key] = value
+    return env
+
+
+def save_env_file(env, path=DAEDALUS_ENV_FILE):
+    content = "# generated by Daedalus, use \"renew_env_var\" instead of editing this file\n"
+    for key in sorted(env):
+        content += "export " + key + "=" + shlex.quote(str(env[key])) + "\n"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "w") as env_file:
+        env_file.write(content)
+        env_file.flush()
+        os.fsync(env_file.fileno())
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, path)
+
 
 def renew_env_var(key, value):
     # Take care, as this function will not change environment variables for parents (aka. bash).
@@ -25,6 +65,9 @@ def renew_env_var(key, value):
     run("echo \"export " + key + "=" + value + "\" >> ~/.bash_profile", shell=True)
     run("echo \"export " + key + "=" + value + "\" >> ~/.bash_login", shell=True)
     run("echo \"export " + key + "=" + value + "\" >> ~/.profile", shell=True)
+    env = load_env_file()
+    env[key] = value
+    save_env_file(env)
 
 
 def apt_update():
@@ -134,20 +177,62 @@ def sanitize_env(env):
     return env
 
 
-def run(command, env=None, overwrite_env=False, shell=True):
-    global current_process
+def get_run_env(env=None, overwrite_env=False):
     if overwrite_env:
         updated_env = env
     else:
         updated_env = os.environ.copy()
         if env:
             updated_env.update(env)
-    updated_env = sanitize_env(updated_env)
-    current_process = subprocess.Popen(command, env=updated_env, shell=shell)
-    current_process.wait()
-    rc = current_process.returncode
-    current_process = None
-    return rc
+    return sanitize_env(updated_env)
+
+
+# "tag" prefixes every output line of the command on the console, "log_path" captures it between timestamped start and
+# exit lines (the console copy is dropped with console=False)
+def run(command, env=None, overwrite_env=False, shell=True, cwd=None, tag=None, log_path=None, log_header=None,
+        console=True):
+    return ProcessManager.run(command, env=get_run_env(env, overwrite_env), shell=shell, cwd=cwd, tag=tag,
+                              log_path=log_path, log_header=log_header, console=console).rc
+
+
+def is_shell_exec_mode(configured_mode=None):
+    return os.environ.get("DAEDALUS_EXEC_MODE", configured_mode) == "shell"
+
+
+# the file can be executed on its own, bash runs the ones without a shebang line itself
+def has_shebang(path):
+    try:
+        with open(path, "rb") as script_file:
+            return script_file.read(2) == b"#!"
+    except OSError:
+        # executing it reports the error
+        return True
+
+
+# argv running a project script directly from the project dir: sudo is only needed when not already root. The
+# "shell" execution mode keeps the former /bin/sh -> sudo -> run_from_path.sh chain as a fallback
+def get_script_command(root_dir, project_dir, script_path, args, shell=False):
+    if shell:
+        command = "sudo -E " + root_dir + "/tools/bash/run_from_path.sh " + project_dir + " " + script_path
+        for arg in args:
+            command += " " + escape_arg(arg)
+        return command
+    argv = [script_path] + [str(arg) for arg in args]
+    if not has_shebang(script_path):
+        argv = ["/bin/bash"] + argv
+    if os.geteuid() != 0:
+        argv = ["sudo", "-E"] + argv
+    return argv
+
+
+# like run(), but the command gets a process group of its own so it can be stopped as a whole: after "timeout"
+# seconds the group gets SIGTERM and, "kill_after" seconds later, SIGKILL. The group stays in the terminal session,
+# so sudo can still prompt for a password, but it no longer gets the terminal's SIGINT and it is forwarded instead
+def run_in_process_group(command, env=None, timeout=None, kill_after=None, shell=True, cwd=None, tag=None,
+                         log_path=None, log_header=None, console=True):
+    return ProcessManager.run(command, env=get_run_env(env), shell=shell, cwd=cwd, tag=tag, new_group=True,
+                              timeout=timeout, kill_after=kill_after, log_path=log_path, log_header=log_header,
+                              console=console)
 
 
 def get_real_path(path, work_dir=None):
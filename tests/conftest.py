@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the sources import each other as top-level modules, like daedalus.py run from source/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "source"))
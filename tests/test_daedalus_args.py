@@ -0,0 +1,47 @@
+import pytest
+
+import daedalus
+
+
+@pytest.fixture(autouse=True)
+def reset_plan_format():
+    daedalus.plan_format = None
+    yield
+    daedalus.plan_format = None
+
+
+def test_options_before_the_command_are_taken():
+    args, env = daedalus.parse_global_args(["daedalus.py", "--force", "-j", "3", "--console=quiet", "--shell-exec",
+                                            "start", "web"])
+    assert args == ["daedalus.py", "start", "web"]
+    assert env == {"DAEDALUS_FORCE_RUN": "1", "DAEDALUS_JOBS": "3", "DAEDALUS_CONSOLE": "quiet",
+                   "DAEDALUS_EXEC_MODE": "shell"}
+
+
+def test_options_after_the_command_are_left_to_it():
+    argv = ["daedalus.py", "exec", "web", "run", "--force", "-j", "3", "--console=raw", "--shell-exec", "--plan"]
+    args, env = daedalus.parse_global_args(argv)
+    assert args == argv
+    assert env == {}
+    assert daedalus.plan_format is None
+
+
+def test_env_is_taken_anywhere():
+    args, env = daedalus.parse_global_args(["daedalus.py", "--env", "A", "1", "start", "--env", "B", "2", "web"])
+    assert args == ["daedalus.py", "start", "web"]
+    assert env == {"A": "1", "B": "2"}
+
+
+def test_plan_sets_the_format():
+    args, _ = daedalus.parse_global_args(["daedalus.py", "--plan", "start"])
+    assert args == ["daedalus.py", "start"]
+    assert daedalus.plan_format == "text"
+    daedalus.parse_global_args(["daedalus.py", "--plan=json", "start"])
+    assert daedalus.plan_format == "json"
+
+
+def test_jobs_must_be_positive():
+    for jobs in ["0", "-1", "two"]:
+        with pytest.raises(SystemExit) as error:
+            daedalus.parse_global_args(["daedalus.py", "--jobs", jobs, "start"])
+        assert error.value.code == 2
@@ -0,0 +1,84 @@
+from graph import CompiledGraph, Graph
+
+
+# edges go from a dependency to its dependent, like the module graph
+def make_graph(edges):
+    graph = Graph()
+    for from_node, to_node in edges:
+        graph.add_edge(from_node, to_node)
+    return graph
+
+
+def test_acyclic_graph_has_no_cycle():
+    graph = make_graph([("base", "db"), ("base", "cache"), ("db", "web"), ("cache", "web")])
+    assert graph.get_cycles() == []
+    assert graph.check_for_cycle() == []
+
+
+def test_cycle_is_closed_by_its_first_node():
+    graph = make_graph([("base", "a"), ("a", "b"), ("b", "c"), ("c", "a"), ("c", "web")])
+    cycle = graph.check_for_cycle()
+    assert cycle[0] == cycle[-1]
+    assert sorted(cycle[:-1]) == ["A", "B", "C"]
+    for from_node, to_node in zip(cycle, cycle[1:]):
+        assert graph.exists_edge(from_node, to_node)
+
+
+def test_self_dependency_is_a_cycle():
+    graph = make_graph([("base", "a"), ("a", "a")])
+    assert graph.get_cycles() == [["A", "A"]]
+
+
+def test_every_cyclic_component_is_reported():
+    graph = make_graph([("a", "b"), ("b", "a"), ("b", "c"), ("c", "d"), ("d", "e"), ("e", "c")])
+    cycles = sorted(sorted(set(cycle)) for cycle in graph.get_cycles())
+    assert cycles == [["A", "B"], ["C", "D", "E"]]
+
+
+def test_long_chains_do_not_hit_the_recursion_limit():
+    names = ["m" + str(index) for index in range(5000)]
+    graph = make_graph(zip(names, names[1:]))
+    assert graph.get_cycles() == []
+    assert graph.topo_sort(names[-1]) == [name.upper() for name in names]
+    graph.add_edge(names[-1], names[0])
+    assert len(graph.check_for_cycle()) == len(names) + 1
+
+
+def test_topo_sort_puts_dependencies_first():
+    graph = make_graph([("base", "db"), ("base", "cache"), ("db", "web"), ("cache", "web"), ("db", "worker")])
+    order = graph.topo_sort_all()
+    assert sorted(order) == ["BASE", "CACHE", "DB", "WEB", "WORKER"]
+    for from_node, to_node in [("base", "db"), ("base", "cache"), ("db", "web"), ("cache", "web"), ("db", "worker")]:
+        assert order.index(from_node.upper()) < order.index(to_node.upper())
+    assert graph.topo_sort("web")[-1] == "WEB"
+    assert "WORKER" not in graph.topo_sort("web")
+
+
+def test_compiled_graph_closures():
+    graph = make_graph([("base", "db"), ("base", "cache"), ("db", "web"), ("cache", "web"), ("db", "worker")])
+    compiled = graph.compile()
+    assert compiled.get_topo_order() == graph.topo_sort_all()
+    assert compiled.get_full_dependencies("web") == graph.topo_sort("web")
+    assert compiled.get_full_dependencies("web", include_self=False) == graph.topo_sort("web")[:-1]
+    assert sorted(compiled.get_names(compiled.get_descendants_mask(["db"]))) == ["WEB", "WORKER"]
+    assert sorted(compiled.get_names(compiled.get_descendants_mask(["cache"], include_self=True))) == ["CACHE", "WEB"]
+    assert compiled.get_ancestors_mask(["base"]) == 0
+    assert compiled.get_mask(["missing"]) == 0
+    assert compiled.get_ancestors_mask(["missing"]) == 0
+
+
+def test_compiled_graph_masks_come_out_topo_sorted():
+    graph = make_graph([("base", "db"), ("base", "cache"), ("db", "web"), ("cache", "web"), ("db", "worker")])
+    compiled = graph.compile()
+    order = compiled.get_topo_order()
+    names = compiled.get_names(compiled.get_mask(["web", "base", "worker"]))
+    assert names == sorted(names, key=order.index)
+
+
+def test_compiled_graph_round_trips_through_data():
+    graph = make_graph([("base", "db"), ("db", "web"), ("base", "web")])
+    compiled = graph.compile()
+    loaded = CompiledGraph.from_data(compiled.to_data())
+    assert loaded.get_topo_order() == compiled.get_topo_order()
+    assert loaded.ancestors == compiled.ancestors
+    assert loaded.descendants == compiled.descendants
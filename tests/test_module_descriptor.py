@@ -0,0 +1,37 @@
+from module_descriptor import DEFAULT_KILL_AFTER, ModuleDescriptor, ScriptDescriptor
+
+
+def test_timeouts_are_parsed_as_seconds():
+    script = ScriptDescriptor({"file": "start.sh", "timeout": "30", "killAfter": 2})
+    assert script.timeout == 30.0
+    assert script.kill_after == 2.0
+    assert script.errors == []
+
+
+def test_timeouts_default_to_none_and_kill_after_default():
+    script = ScriptDescriptor({"file": "start.sh"})
+    assert script.timeout is None
+    assert script.kill_after == DEFAULT_KILL_AFTER
+    assert script.errors == []
+
+
+def test_kill_after_can_be_zero():
+    script = ScriptDescriptor({"file": "start.sh", "timeout": 1, "killAfter": 0})
+    assert script.kill_after == 0
+    assert script.errors == []
+
+
+def test_bad_timeouts_are_reported():
+    for timeout, kill_after in [("abc", 1), (0, 1), (-5, 1), (True, 1), ([1], 1), (1, -1), (1, "soon")]:
+        script = ScriptDescriptor({"file": "start.sh", "timeout": timeout, "killAfter": kill_after})
+        assert len(script.errors) == 1, (timeout, kill_after)
+
+
+def test_first_alias_wins():
+    descriptor = ModuleDescriptor({"scripts": [
+        {"file": "a.sh", "aliases": ["start", "run"]},
+        {"file": "b.sh", "aliases": ["start"]},
+    ]})
+    assert descriptor.get_script("start").file == "a.sh"
+    assert descriptor.get_script("run").file == "a.sh"
+    assert descriptor.get_script("stop") is None
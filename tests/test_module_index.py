@@ -0,0 +1,63 @@
+import os
+
+from module_index import ModuleIndex, get_stamp
+
+
+def write(path, text):
+    with open(path, "w") as out_file:
+        out_file.write(text)
+
+
+def test_index_round_trips_through_disk(tmp_path):
+    description_path = str(tmp_path / "description.json")
+    write(description_path, "{}")
+    index_path = str(tmp_path / "state" / "index.json")
+    index = ModuleIndex(index_path)
+    index.set_module_list(["web"], [], {description_path: get_stamp(description_path)})
+    index.set_description(description_path, {"version": "1"}, get_stamp(description_path))
+    index.set_compiled_graph({"names": ["WEB"], "dependencies": [[]]})
+    index.save()
+    assert not index.changed
+
+    loaded = ModuleIndex(index_path)
+    assert loaded.get_module_list() == (["web"], [])
+    assert loaded.get_description(description_path, get_stamp(description_path)) == {"version": "1"}
+    assert loaded.compiled_graph == {"names": ["WEB"], "dependencies": [[]]}
+
+
+def test_stale_entries_are_ignored(tmp_path):
+    description_path = str(tmp_path / "description.json")
+    write(description_path, "{}")
+    index = ModuleIndex(str(tmp_path / "index.json"))
+    stamp = get_stamp(description_path)
+    index.set_module_list(["web"], [], {description_path: stamp})
+    index.set_description(description_path, {"version": "1"}, stamp)
+    write(description_path, '{"version": "2"}')
+    assert index.get_module_list() is None
+    assert index.get_description(description_path, get_stamp(description_path)) is None
+    assert index.get_description(description_path, None) is None
+
+
+def test_changes_drop_the_compiled_graph(tmp_path):
+    index = ModuleIndex(str(tmp_path / "index.json"))
+    index.set_compiled_graph({"names": [], "dependencies": []})
+    index.set_description(str(tmp_path / "description.json"), None, None)
+    assert index.compiled_graph is None
+
+
+def test_other_index_versions_are_ignored(tmp_path):
+    index_path = str(tmp_path / "index.json")
+    write(index_path, '{"version": 0, "moduleList": {"modules": [], "configPlugins": [], "stamps": {}}}')
+    assert ModuleIndex(index_path).module_list is None
+    write(index_path, "not json")
+    assert ModuleIndex(index_path).module_list is None
+
+
+def test_prune_drops_removed_descriptions(tmp_path):
+    index = ModuleIndex(str(tmp_path / "index.json"))
+    kept_path = os.path.join(str(tmp_path), "kept.json")
+    removed_path = os.path.join(str(tmp_path), "removed.json")
+    index.set_description(kept_path, {}, [1, 2])
+    index.set_description(removed_path, {}, [1, 2])
+    index.prune({kept_path})
+    assert list(index.descriptions) == [kept_path]
@@ -0,0 +1,127 @@
+import threading
+
+from scheduler import Scheduler
+
+
+def record(runs, name, rc=0):
+    def func():
+        runs.append(name)
+        return rc
+    return func
+
+
+def test_single_worker_keeps_serial_order():
+    runs = []
+    scheduler = Scheduler(jobs=1)
+    for name in ["a", "b", "c"]:
+        scheduler.add_task(name, record(runs, name))
+    result = scheduler.run()
+    assert runs == ["a", "b", "c"]
+    assert result.get_rc() == 0
+
+
+def test_dependencies_run_first():
+    runs = []
+    scheduler = Scheduler(jobs=4)
+    scheduler.add_task("c", record(runs, "c"), dependencies=["a", "b"])
+    scheduler.add_task("a", record(runs, "a"))
+    scheduler.add_task("b", record(runs, "b"), dependencies=["a"])
+    scheduler.run()
+    assert runs == ["a", "b", "c"]
+
+
+def test_barrier_groups_run_in_the_order_they_are_added():
+    runs = []
+    scheduler = Scheduler(jobs=4)
+    scheduler.add_task("late", record(runs, "late"), barrier=1)
+    scheduler.add_task("early", record(runs, "early"), barrier=0)
+    scheduler.run()
+    assert runs == ["late", "early"]
+
+
+def test_failure_skips_dependents():
+    runs = []
+    scheduler = Scheduler(jobs=2, keep_going=False)
+    scheduler.add_task("a", record(runs, "a", rc=3))
+    scheduler.add_task("b", record(runs, "b"), dependencies=["a"])
+    scheduler.add_task("c", record(runs, "c"), dependencies=["b"])
+    scheduler.add_task("d", record(runs, "d"))
+    result = scheduler.run()
+    assert sorted(runs) == ["a", "d"]
+    assert result.get_failed() == ["a"]
+    assert result.get_skipped() == ["b", "c"]
+    assert result.get_rc() == 3
+
+
+def test_failure_skips_dependents_in_later_groups():
+    runs = []
+    scheduler = Scheduler(jobs=2, keep_going=False)
+    scheduler.add_task("a", record(runs, "a", rc=1), barrier=0)
+    scheduler.add_task("b", record(runs, "b"), dependencies=["a"], barrier=1)
+    scheduler.add_task("c", record(runs, "c"), barrier=1)
+    result = scheduler.run()
+    assert runs == ["a", "c"]
+    assert result.get_skipped() == ["b"]
+
+
+def test_keep_going_runs_dependents():
+    runs = []
+    scheduler = Scheduler(jobs=1, keep_going=True)
+    scheduler.add_task("a", record(runs, "a", rc=1))
+    scheduler.add_task("b", record(runs, "b"), dependencies=["a"])
+    result = scheduler.run()
+    assert runs == ["a", "b"]
+    assert result.get_rc() == 1
+
+
+def test_exit_in_a_task_is_its_rc():
+    scheduler = Scheduler(jobs=1, keep_going=False)
+    scheduler.add_task("a", lambda: exit(2))
+    scheduler.add_task("b", lambda: 0, dependencies=["a"])
+    result = scheduler.run()
+    assert result.get_rc() == 2
+    assert result.get_skipped() == ["b"]
+
+
+def test_jobs_limit_concurrent_tasks():
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def func():
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        threading.Event().wait(0.05)
+        with lock:
+            running[0] -= 1
+
+    scheduler = Scheduler(jobs=2)
+    for index in range(6):
+        scheduler.add_task(str(index), func)
+    scheduler.run()
+    assert running[1] == 2
+
+
+def test_group_limit_caps_its_tasks_only():
+    lock = threading.Lock()
+    running = {}
+    peaks = {}
+
+    def func(group):
+        def run():
+            with lock:
+                running[group] = running.get(group, 0) + 1
+                peaks[group] = max(peaks.get(group, 0), running[group])
+            threading.Event().wait(0.05)
+            with lock:
+                running[group] -= 1
+        return run
+
+    scheduler = Scheduler(jobs=4)
+    scheduler.set_limit("worker", 1)
+    for index in range(4):
+        scheduler.add_task("worker#" + str(index), func("worker"), group="worker")
+        scheduler.add_task("web#" + str(index), func("web"), group="web")
+    scheduler.run()
+    assert peaks["worker"] == 1
+    assert peaks["web"] == 3
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+# Measures Daedalus' own startup overhead (wall time and peak RSS) for the CLI entry points against a synthetic
+# install built in a temporary directory. Module scripts are stubbed, so only Daedalus itself is measured.
+#
+# usage: startup_benchmark.py [--modules N] [--config-plugins P] [--keys M] [--repeat R] [--daemon]
+#                             [--python <path>] [--output <path>] [--keep]
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+SOURCE_DIR = os.path.join(REPO_ROOT, "source")
+PROJECT_NAME = "benchmark"
+
+ENTRY_POINTS = [
+    ["bare", []],
+    ["configfs-show", ["configfs", "show", "key-0"]],
+    ["list-modules", ["list-modules"]],
+    ["info", ["info"]],
+    ["get-metadata", ["get-metadata"]],
+    ["plugin", ["hosts", "show"]],
+]
+
+STUB_SCRIPT = "#!/bin/sh\nexit 0\n"
+
+
+def get_current_version():
+    with open(os.path.join(SOURCE_DIR, "daedalus.py")) as daedalus_file:
+        for line in daedalus_file:
+            if line.startswith("CURRENT_DAEDALUS_VERSION"):
+                return line.split("=")[1].strip().strip("\"")
+    return None
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as json_file:
+        json.dump(data, json_file)
+
+
+def write_module(modules_dir, name, dependencies, rng):
+    module_dir = os.path.join(modules_dir, name)
+    scripts_dir = os.path.join(module_dir, "scripts")
+    os.makedirs(scripts_dir, exist_ok=True)
+    scripts = [
+        {"aliases": ["install"], "file": "install.sh", "isInstallScript": True, "isRecursive": True},
+        {"aliases": ["start"], "file": "start.sh", "priority": rng.choice([0, 0, 0, "FIRST", "LAST"]),
+         "params": ["key-" + str(rng.randrange(10)) + ":default"]},
+        {"aliases": ["stop"], "file": "stop.sh"},
+        {"aliases": ["update"], "file": "update.sh"},
+    ]
+    for script in scripts:
+        script_path = os.path.join(scripts_dir, script["file"])
+        with open(script_path, "w") as script_file:
+            script_file.write(STUB_SCRIPT)
+        os.chmod(script_path, 0o755)
+    write_json(os.path.join(module_dir, "description.json"), {
+        "module": name,
+        "version": "1.0",
+        "dependencies": dependencies,
+        "scripts": scripts
+    })
+
+
+def build_modules(modules_dir, names, rng):
+    for index, name in enumerate(names):
+        dependencies = []
+        if index > 0:
+            for _ in range(rng.randrange(4)):
+                dependency = names[rng.randrange(index)]
+                if dependency not in dependencies:
+                    dependencies.append(dependency)
+        write_module(modules_dir, name, dependencies, rng)
+
+
+def build_install(base_dir, module_count, config_plugin_count, key_count, seed=1):
+    rng = random.Random(seed)
+    root_dir = os.path.join(base_dir, "root")
+    project_dir = os.path.join(base_dir, "project")
+    state_dir = os.path.join(root_dir, "state")
+    configfs_dir = os.path.join(state_dir, "projects", PROJECT_NAME, "configfs")
+    os.makedirs(configfs_dir, exist_ok=True)
+    os.makedirs(os.path.join(configfs_dir, "list"), exist_ok=True)
+    os.symlink(os.path.join(REPO_ROOT, "tools"), os.path.join(root_dir, "tools"))
+    shutil.copy(os.path.join(REPO_ROOT, "version.json"), os.path.join(root_dir, "version.json"))
+
+    write_json(os.path.join(state_dir, "projects.json"), {
+        "current": PROJECT_NAME,
+        "projects": {PROJECT_NAME: {"root": project_dir}}
+    })
+
+    # modules are split between the project and its config plugins
+    group_count = config_plugin_count + 1
+    module_names = []
+    project_modules = ["module-" + str(index) for index in range(0, module_count, group_count)]
+    build_modules(os.path.join(project_dir, ".daedalus/modules"), project_modules, rng)
+    module_names += project_modules
+
+    config_plugins = {}
+    for plugin_index in range(config_plugin_count):
+        plugin_name = "plugin" + str(plugin_index)
+        plugin_dir = os.path.join(base_dir, "config_plugins", plugin_name)
+        config_plugins[plugin_name] = {"path": plugin_dir}
+        plugin_modules = ["module-" + str(index) for index in range(plugin_index + 1, module_count, group_count)]
+        build_modules(os.path.join(plugin_dir, "modules"), plugin_modules, rng)
+        module_names += [plugin_name + "." + name for name in plugin_modules]
+    write_json(os.path.join(state_dir, "config_plugins.json"), config_plugins)
+
+    for index in range(key_count):
+        with open(os.path.join(configfs_dir, "key-" + str(index)), "w") as key_file:
+            key_file.write("value-" + str(index))
+    for index, name in enumerate(module_names):
+        if index % 2 == 0:
+            version_key = name + "-version"
+            if index % 10 == 0:
+                version_key += "#ns" + str(index)
+            with open(os.path.join(configfs_dir, version_key), "w") as key_file:
+                key_file.write("1.0")
+
+    return root_dir, project_dir
+
+
+def get_env(base_dir, root_dir):
+    env = os.environ.copy()
+    env["DAEDALUS_ROOT"] = root_dir
+    env["DAEDALUS_VERSION"] = get_current_version()
+    env["DAEDALUS_WORKING_DIRECTORY"] = base_dir
+    env["DAEDALUS_ENV_FILE"] = os.path.join(base_dir, "env")
+    env.pop("DAEDALUS_FILE_LOCK_SESSION_UID", None)
+    return env
+
+
+def run_once(command, env, cwd):
+    start_time = time.time()
+    process = subprocess.Popen(command, env=env, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    # wait4 gives the resource usage of this child only, ru_maxrss is reported in kilobytes on Linux
+    _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.time() - start_time
+    rc = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    process.returncode = rc
+    return wall_time, usage.ru_maxrss, rc
+
+
+def measure(command, env, cwd, repeat):
+    wall_times = []
+    peak_rss = []
+    return_codes = set()
+    # one warm-up run so the bytecode cache is in place for every entry point
+    run_once(command, env, cwd)
+    for _ in range(repeat):
+        wall_time, rss, rc = run_once(command, env, cwd)
+        wall_times.append(wall_time * 1000)
+        peak_rss.append(rss)
+        return_codes.add(rc)
+    return {
+        "wallTimeMs": {
+            "min": min(wall_times),
+            "median": statistics.median(wall_times),
+            "mean": statistics.mean(wall_times),
+            "max": max(wall_times)
+        },
+        "peakRssKb": max(peak_rss),
+        "returnCodes": sorted(return_codes)
+    }
+
+
+def start_daemon(python, env, root_dir):
+    daemon = subprocess.Popen([python, os.path.join(SOURCE_DIR, "daedalus.py"), "serve"], env=env, cwd=root_dir,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    socket_path = os.path.join(root_dir, "state/daemon.sock")
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            return daemon
+        time.sleep(0.05)
+    daemon.kill()
+    print("Benchmark: daemon did not start")
+    exit(2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Daedalus CLI startup latency benchmark")
+    parser.add_argument("--modules", type=int, default=100, help="number of modules")
+    parser.add_argument("--config-plugins", type=int, default=2, help="number of config plugins")
+    parser.add_argument("--keys", type=int, default=500, help="number of ConfigFS keys")
+    parser.add_argument("--repeat", type=int, default=10, help="measured runs per entry point")
+    parser.add_argument("--python", default=sys.executable, help="interpreter used to run Daedalus")
+    parser.add_argument("--daemon", action="store_true", help="also measure calls through \"daedalus serve\"")
+    parser.add_argument("--output", default=None, help="write the JSON results here instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic install")
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp(prefix="daedalus-benchmark-")
+    daemon = None
+    try:
+        root_dir, _ = build_install(base_dir, args.modules, args.config_plugins, args.keys)
+        env = get_env(base_dir, root_dir)
+        results = {
+            "python": args.python,
+            "modules": args.modules,
+            "configPlugins": args.config_plugins,
+            "keys": args.keys,
+            "repeat": args.repeat,
+            "entryPoints": {}
+        }
+        daedalus_command = [args.python, os.path.join(SOURCE_DIR, "daedalus.py")]
+        for name, entry_args in ENTRY_POINTS:
+            results["entryPoints"][name] = measure(daedalus_command + entry_args, env, root_dir, args.repeat)
+
+        if args.daemon:
+            daemon = start_daemon(args.python, env, root_dir)
+            client_command = [args.python, "-S", os.path.join(SOURCE_DIR, "client.py")]
+            results["daemonEntryPoints"] = {}
+            for name, entry_args in ENTRY_POINTS:
+                results["daemonEntryPoints"][name] = measure(client_command + entry_args, env, root_dir,
+                                                             args.repeat)
+    finally:
+        if daemon is not None:
+            daemon.send_signal(signal.SIGTERM)
+            daemon.wait()
+        if args.keep:
+            print("Benchmark: synthetic install kept at " + base_dir, file=sys.stderr)
+        else:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    output = json.dumps(results, indent=4)
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()